@@ -0,0 +1,212 @@
+# headless recognition of many images without the GUI (and without Qt at all)
+# usage: python batch_recognize.py <images directory or .npy stack> <results.jsonl or results.csv> [options]
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+import cv2
+import numpy as np
+import metrics
+from cluster import Clusterizator, KMeansEngine, ConnectedComponentsEngine, SweepMode
+from numbers_recognition import NumbersRecognizer, RecognizerBackend
+from prediction_cache import predict_clusters
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+ENGINES = ("kmeans", "kmeans-incremental", "components")
+BACKENDS = tuple(backend.name.lower() for backend in RecognizerBackend)
+
+
+class BatchOptions(object):
+    # everything a worker process needs to recognize an image, must be picklable
+    def __init__(self, engine: str = "kmeans", auto_find_clusters_count: bool = True, clusters_count: int = 20,
+                 dilation: int = 5, threshold: int = 255, invert: bool = False, backend: str = None):
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine: %s" % engine)
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError("Unknown backend: %s" % backend)
+        self.engine = engine
+        self.auto_find_clusters_count = auto_find_clusters_count
+        self.clusters_count = clusters_count
+        self.dilation = dilation
+        # a pixel is ink when its grayscale value is below the threshold (after inversion, if any)
+        self.threshold = threshold
+        self.invert = invert
+        # None is the default backend of the recognizer
+        self.backend = backend
+
+    def get_backend(self):
+        if self.backend is None:
+            return NumbersRecognizer.get_default_backend()
+        return RecognizerBackend[self.backend.upper()]
+
+    def create_engine(self):
+        if self.engine == "kmeans":
+            return KMeansEngine()
+        if self.engine == "kmeans-incremental":
+            return KMeansEngine(mode=SweepMode.INCREMENTAL)
+        return ConnectedComponentsEngine(self.dilation)
+
+
+def list_images(source: str):
+    # tasks are small descriptors, every worker reads the image itself, so images are never pickled
+    # and a .npy stack is never loaded completely: (name, file path, index in the stack or None).
+    # A 2-D .npy array is a single image, arrays of more dimensions are stacks of images
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return [(name, os.path.join(source, name), None) for name in names]
+    if source.endswith(".npy"):
+        stack = np.load(source, mmap_mode="r")
+        if stack.ndim > 2:
+            return [(str(i), source, i) for i in range(len(stack))]
+    return [(os.path.basename(source), source, None)]
+
+
+def read_image(file_path: str, index: int = None):
+    # returns a grayscale (height, width) matrix
+    if file_path.endswith(".npy"):
+        image = np.load(file_path, mmap_mode="r")
+        image = np.asarray(image if index is None else image[index])
+        if image.ndim == 3:
+            image = image[:, :, 0] if image.shape[2] == 1 else cv2.cvtColor(image[:, :, :3], cv2.COLOR_RGB2GRAY)
+        if image.dtype != np.uint8:
+            # float stacks (for example normalized MNIST) are scaled to 0..255
+            scale = 255 if image.max(initial=0) <= 1 else 1
+            image = np.clip(image * scale, 0, 255).astype(np.uint8)
+        return image
+    image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise IOError("Cannot read image: %s" % file_path)
+    return image
+
+
+def recognize_image(image: np.ndarray, options: BatchOptions = None, recognizer: NumbersRecognizer = None):
+    # recognizes all digits of a grayscale image, returns a list of dictionaries ordered from left to right
+    options = options if options is not None else BatchOptions()
+    recognizer = recognizer if recognizer is not None else NumbersRecognizer.get_instance(options.get_backend())
+    if options.invert:
+        image = 255 - image
+    clusterizator = Clusterizator(image < options.threshold, options.create_engine())
+    clusters = clusterizator.clusterize(options.auto_find_clusters_count, options.clusters_count)
+    # every worker process has its own cache, repeated digits of a batch are predicted once per process
+    _, predictions = predict_clusters(clusters, recognizer)
+
+    digits = []
+    for cluster, prediction in zip(clusters, predictions):
+        digit = int(np.argmax(prediction))
+        digits.append({"digit": digit, "probability": float(prediction[digit]), "points": len(cluster),
+                       "bbox": [int(c) for c in cluster.get_bounding_box()]})
+    digits.sort(key=lambda d: d["bbox"][0])
+    return digits
+
+
+# the state of a worker process: the model is loaded once per process, not once per image
+_worker_options = None
+_worker_recognizer = None
+
+
+def _init_worker(options: BatchOptions):
+    global _worker_options, _worker_recognizer
+    _worker_options = options
+    _worker_recognizer = NumbersRecognizer.get_instance(options.get_backend())
+
+
+def _recognize_task(task):
+    name, file_path, index = task
+    start = time.perf_counter()
+    recorder = metrics.Recorder("image")
+    try:
+        with metrics.recording(recorder):
+            digits = recognize_image(read_image(file_path, index), _worker_options, _worker_recognizer)
+    except Exception as e:
+        return {"image": name, "error": "%s: %s" % (type(e).__name__, e)}
+    return {"image": name, "text": "".join(str(d["digit"]) for d in digits), "digits": digits,
+            "time": round(time.perf_counter() - start, 4),
+            "stages": {stage: round(duration, 4) for stage, duration in recorder.get_durations().items()},
+            "counters": recorder.get_counters()}
+
+
+def recognize_source(source: str, options: BatchOptions = None, workers: int = 1):
+    # yields results in the order of images as soon as they are ready
+    options = options if options is not None else BatchOptions()
+    tasks = list_images(source)
+    if workers <= 1:
+        _init_worker(options)
+        for task in tasks:
+            yield _recognize_task(task)
+        return
+    with Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for result in pool.imap(_recognize_task, tasks):
+            yield result
+
+
+class JsonLinesWriter(object):
+    def __init__(self, file):
+        self.__file = file
+
+    def write(self, result: dict):
+        self.__file.write(json.dumps(result) + "\n")
+        self.__file.flush()
+
+
+class CsvWriter(object):
+    # one row per recognized digit, images without digits get one row with empty digit columns
+    COLUMNS = ("image", "digit", "probability", "min_x", "min_y", "max_x", "max_y", "error")
+
+    def __init__(self, file):
+        self.__file = file
+        self.__writer = csv.writer(file)
+        self.__writer.writerow(self.COLUMNS)
+
+    def write(self, result: dict):
+        if not result.get("digits"):
+            self.__writer.writerow([result["image"], "", "", "", "", "", "", result.get("error", "")])
+        for d in result.get("digits", []):
+            self.__writer.writerow([result["image"], d["digit"], "%.4f" % d["probability"]] + d["bbox"] + [""])
+        self.__file.flush()
+
+
+def write_results(results, output_path: str):
+    # results are written (and flushed) one by one, so a long run can be watched and an interrupted one is not lost
+    writer_class = CsvWriter if output_path.lower().endswith(".csv") else JsonLinesWriter
+    count = errors = 0
+    with open(output_path, "w", newline="") as file:
+        writer = writer_class(file)
+        for result in results:
+            writer.write(result)
+            count += 1
+            errors += "error" in result
+    return count, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize digits in many images without the GUI")
+    parser.add_argument("source", help="directory with images, an image or a .npy stack of grayscale images")
+    parser.add_argument("output", help="results file, .csv for CSV, otherwise JSON lines")
+    parser.add_argument("--engine", choices=ENGINES, default="kmeans")
+    parser.add_argument("--clusters", type=int, default=20,
+                        help="maximum clusters count (or the exact count with --fixed-count)")
+    parser.add_argument("--fixed-count", action="store_true", help="do not search for the clusters count")
+    parser.add_argument("--dilation", type=int, default=5, help="dilation in pixels for the components engine")
+    parser.add_argument("--threshold", type=int, default=255, help="a pixel is ink when it is darker than this")
+    parser.add_argument("--invert", action="store_true", help="images are light digits on a dark background")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="model backend, int8 is the fastest one (it needs TensorFlow Lite)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--debug", action="store_true", help="log verbose dumps of the pipeline")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    options = BatchOptions(args.engine, not args.fixed_count, args.clusters, args.dilation, args.threshold,
+                           args.invert, args.backend)
+    start = time.perf_counter()
+    count, errors = write_results(recognize_source(args.source, options, args.workers), args.output)
+    print("%d images recognized (%d errors) in %.2f s" % (count, errors, time.perf_counter() - start),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
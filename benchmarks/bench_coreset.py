@@ -0,0 +1,27 @@
+# usage (from the repository root): python -m benchmarks.bench_coreset
+from sklearn.metrics import adjusted_rand_score
+from benchmarks.canvas import make_canvas, measure
+from cluster import PointsArray, KMeansEngine, get_ink_coordinates, _get_grid_coreset
+
+
+def main():
+    digits_count = 8
+    print("%-6s %8s %6s %10s %10s %8s" % ("pen", "points", "grid", "coreset", "time, s", "ARI"))
+    for pen_width in (2, 8, 16):
+        points_array = PointsArray(*get_ink_coordinates(make_canvas(1024, 768, digits_count, pen_width=pen_width)))
+        reference = None
+        for grid_step in (1, 2, 4, 8, 16):
+            engine = KMeansEngine(grid_step=grid_step)
+            rs = []
+            elapsed = measure(lambda: rs.append(engine.find_labels(points_array, False, digits_count)), repeat=1)
+            labels, _ = rs[0]
+            if reference is None:
+                reference = labels
+            coreset_size = len(_get_grid_coreset(points_array.get_features(), grid_step)[0])
+            # labels are compared with the full resolution result
+            print("%-6d %8d %6d %10d %10.3f %8.3f" % (pen_width, len(points_array), grid_step, coreset_size, elapsed,
+                                                     adjusted_rand_score(reference, labels)))
+
+
+if __name__ == '__main__':
+    main()
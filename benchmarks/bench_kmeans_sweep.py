@@ -0,0 +1,30 @@
+# usage (from the repository root): python -m benchmarks.bench_kmeans_sweep
+from sklearn.metrics import adjusted_rand_score
+from benchmarks.canvas import make_canvas, measure
+from cluster import PointsArray, KMeansEngine, ConnectedComponentsEngine, SweepMode, ClustersCountPolicy, \
+    get_ink_coordinates
+
+
+def main():
+    max_clusters = 20
+    print("%-7s %-12s %-11s %8s %10s %8s" % ("digits", "mode", "policy", "k found", "time, s", "ARI"))
+    for digits_count in (3, 5, 8, 12):
+        points_array = PointsArray(*get_ink_coordinates(make_canvas(1024, 768, digits_count, seed=digits_count)))
+        # every synthetic digit is a separate ink blob, so connected components give the true clusters
+        truth, _ = ConnectedComponentsEngine().find_labels(points_array, True, max_clusters)
+        for mode in (SweepMode.FULL, SweepMode.INCREMENTAL):
+            for policy in (ClustersCountPolicy.ELBOW, ClustersCountPolicy.SILHOUETTE):
+                engine = KMeansEngine(mode=mode, policy=policy)
+                rs = []
+                elapsed = measure(lambda: rs.append(engine.find_labels(points_array, True, max_clusters)), repeat=1)
+                if rs[0] is None:
+                    print("%-7d %-12s %-11s %8s %10.3f %8s" % (digits_count, mode.name, policy.name, "-",
+                                                              elapsed, "-"))
+                    continue
+                labels, nclusters = rs[0]
+                print("%-7d %-12s %-11s %8d %10.3f %8.3f" % (digits_count, mode.name, policy.name, nclusters,
+                                                            elapsed, adjusted_rand_score(truth, labels)))
+
+
+if __name__ == '__main__':
+    main()
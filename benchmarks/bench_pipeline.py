@@ -0,0 +1,162 @@
+# usage (from the repository root): python -m benchmarks.bench_pipeline [--output bench_pipeline.json]
+# composes canvases from the MNIST test images, runs the whole recognition pipeline stage by stage and reports
+# latencies, peak memory, segmentation and digit accuracy; results are saved as JSON to compare runs
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from benchmarks.canvas import make_mnist_canvas
+from cluster import PointsArray, KMeansEngine, ConnectedComponentsEngine, SweepMode, get_ink_coordinates
+from image_converter import ImageConverter
+import metrics
+from numbers_recognition import NumbersRecognizer
+
+# clustering is the whole run of the engine, k_search and kmeans_fit are its spans (see metrics.py), they are 0
+# for the engines without them
+STAGES = ("extraction", "clustering", "k_search", "kmeans_fit", "conversion", "inference")
+ENGINE_SPANS = ("k_search", "kmeans_fit")
+ENGINES = {
+    "kmeans": lambda: KMeansEngine(),
+    "kmeans-incremental": lambda: KMeansEngine(mode=SweepMode.INCREMENTAL),
+    "components": lambda: ConnectedComponentsEngine(5),
+}
+
+
+def run_pipeline(image, engine, max_clusters: int, recognizer: NumbersRecognizer, trace_memory: bool = False):
+    # the same steps as RecognitionWorker, but every stage is timed (or traced) separately; the engine runs once
+    # with the automatic clusters count and its labels are scored, as in the application
+    times, peaks, rs = {}, {}, {}
+
+    def stage(name, func):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        rs[name] = func()
+        times[name] = time.perf_counter() - start
+        if trace_memory:
+            peaks[name] = tracemalloc.get_traced_memory()[1] - start_memory
+
+    def cluster():
+        found = engine.find_labels(points_array, True, max_clusters)
+        return points_array.set_labels(*found) if found is not None else []
+
+    stage("extraction", lambda: PointsArray(*get_ink_coordinates(image)))
+    points_array = rs["extraction"]
+    recorder = metrics.Recorder("bench_pipeline")
+    with metrics.recording(recorder):
+        stage("clustering", cluster)
+    durations = recorder.get_durations()
+    times.update({name: durations.get(name, 0.0) for name in ENGINE_SPANS})
+    clusters = rs["clustering"]
+    stage("conversion", lambda: ImageConverter.convert_batch(clusters))
+    stage("inference", lambda: recognizer.predict_batch(rs["conversion"][0]))
+    return points_array, clusters, rs["inference"], times, peaks
+
+
+def score(points_array, clusters, predictions, truth, digits):
+    # segmentation: adjusted Rand index of the clusters against the true digits of ink pixels;
+    # digits: every true digit is read from the cluster covering most of its pixels
+    true_labels = truth[points_array.ys, points_array.xs]
+    pixel_clusters = np.full(truth.shape, -1, dtype=np.int32)
+    for i, cluster in enumerate(clusters):
+        pixel_clusters[cluster.ys, cluster.xs] = i
+    predicted_labels = pixel_clusters[points_array.ys, points_array.xs]
+
+    read = [int(np.argmax(p)) for p in predictions]
+    correct = 0
+    for i, digit in enumerate(digits):
+        overlap = predicted_labels[(true_labels == i) & (predicted_labels >= 0)]
+        if len(overlap) > 0 and read[np.bincount(overlap).argmax()] == digit:
+            correct += 1
+    order = np.argsort([cluster.get_bounding_box()[0] for cluster in clusters], kind="stable")
+    text = "".join(str(read[i]) for i in order)
+    return {
+        "ari": float(adjusted_rand_score(true_labels, predicted_labels)),
+        "clusters_count_correct": len(clusters) == len(digits),
+        "digit_accuracy": correct / len(digits),
+        "text_correct": text == "".join(str(d) for d in digits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the recognition pipeline")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--digits", nargs="+", type=int, default=[3, 5, 8], help="digits per canvas")
+    parser.add_argument("--size", type=int, default=56, help="digit size in pixels")
+    parser.add_argument("--spacing", type=int, default=20, help="space between digits in pixels")
+    parser.add_argument("--canvases", type=int, default=5, help="canvases per configuration")
+    parser.add_argument("--max-clusters", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    args = parser.parse_args()
+
+    recognizer = NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend())
+    x_test, y_test = recognizer.get_test_data()
+    y_test = y_test.argmax(axis=1)
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    print("%-19s %6s" % ("engine", "digits"), *("%15s" % ("%s, ms" % name) for name in STAGES),
+          "%8s %8s %8s" % ("ARI", "digits", "texts"))
+    for digits_count in args.digits:
+        # the same canvases for every engine
+        canvases = []
+        for i in range(args.canvases):
+            indices = np.sort(rng.choice(len(x_test), digits_count, replace=False))
+            canvases.append(make_mnist_canvas(x_test[indices], y_test[indices], args.size, args.spacing,
+                                              seed=args.seed + i))
+        for engine_name in args.engines:
+            engine = ENGINES[engine_name]()
+            # memory is traced in a separate run of the first canvas, tracing slows allocations down a lot
+            tracemalloc.start()
+            peaks = run_pipeline(canvases[0][0], engine, args.max_clusters, recognizer, trace_memory=True)[4]
+            tracemalloc.stop()
+
+            times, scores = {name: [] for name in STAGES}, []
+            for image, truth, digits in canvases:
+                points_array, clusters, predictions, stage_times, _ = run_pipeline(image, engine, args.max_clusters,
+                                                                                   recognizer)
+                for name in STAGES:
+                    times[name].append(stage_times[name])
+                scores.append(score(points_array, clusters, predictions, truth, digits))
+
+            result = {
+                "engine": engine_name,
+                "digits": digits_count,
+                "canvases": len(canvases),
+                "latency_ms": {name: {"mean": 1000 * float(np.mean(values)), "median": 1000 * float(np.median(values)),
+                                      "max": 1000 * float(np.max(values))} for name, values in times.items()},
+                "peak_memory_bytes": peaks,
+                "ari": float(np.mean([s["ari"] for s in scores])),
+                "clusters_count_accuracy": float(np.mean([s["clusters_count_correct"] for s in scores])),
+                "digit_accuracy": float(np.mean([s["digit_accuracy"] for s in scores])),
+                "text_accuracy": float(np.mean([s["text_correct"] for s in scores])),
+            }
+            results.append(result)
+            print("%-19s %6d" % (engine_name, digits_count),
+                  *("%15.1f" % result["latency_ms"][name]["median"] for name in STAGES),
+                  "%8.3f %8.3f %8.3f" % (result["ari"], result["digit_accuracy"], result["text_accuracy"]))
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": NumbersRecognizer.get_default_backend().name,
+        "parameters": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("saved to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# usage (from the repository root): python -m benchmarks.bench_pixel_extraction
+import numpy as np
+from benchmarks.canvas import make_canvas, measure
+from cluster import Point, get_ink_coordinates
+from PyQt6.QtGui import QImage
+
+
+def legacy_prepare_data(image: QImage):
+    # the original per-pixel implementation of Clusterizator.__prepare_data
+    transform_func = lambda c: \
+        0.0 if c[0][0] == 255 else \
+            1.0 if c[0][0] == 0 else \
+                (c[0][0] + c[0][1] + c[0][2]) / 3 / 255
+    transform_func_vec = np.vectorize(transform_func, signature="(n,m)->()")
+
+    ptr = image.bits()
+    ptr.setsize(image.sizeInBytes())
+    image_vector = np.asarray(ptr).reshape(image.height() * image.width(), 1, 4)
+    rs = transform_func_vec(image_vector)
+    rs = rs.reshape(image.height(), image.width())
+
+    points = []
+    for i in range(image.height()):
+        for j in range(image.width()):
+            if rs[i, j] != 0.0:
+                points.append(Point(j, i))
+    return points
+
+
+def main():
+    sizes = [(320, 240), (640, 480), (1024, 768), (1920, 1080)]
+    print("%-12s %10s %12s %12s %10s" % ("canvas", "points", "legacy, s", "array, s", "speedup"))
+    for width, height in sizes:
+        image = make_canvas(width, height, 10)
+        legacy_points = legacy_prepare_data(image)
+        xs, ys = get_ink_coordinates(image)
+        assert len(legacy_points) == len(xs)
+        assert all(p.x == x and p.y == y for p, x, y in zip(legacy_points, xs, ys))
+
+        legacy_time = measure(lambda: legacy_prepare_data(image), repeat=1)
+        array_time = measure(lambda: get_ink_coordinates(image))
+        print("%-12s %10d %12.4f %12.4f %9.0fx" % ("%dx%d" % (width, height), len(xs),
+                                                   legacy_time, array_time, legacy_time / array_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# usage (from the repository root): python -m benchmarks.bench_quantization [--output bench_quantization.json]
+# compares the int8 model with the float32 one: accuracy on the MNIST test set, latency of a batch of every size
+# and memory: the model file, and the resident memory of a process taken by loading the model and by predicting
+# one batch (measured in a new process for every backend, after the runtime of the backend is imported)
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from numbers_recognition import NumbersRecognizer, RecognizerBackend, NUMPY_WEIGHTS_FILE_PATH, \
+    INT8_MODEL_FILE_PATH, MODEL_FILE_PATH
+
+BACKENDS = {
+    "keras": RecognizerBackend.KERAS,
+    "numpy": RecognizerBackend.NUMPY,
+    "int8": RecognizerBackend.INT8,
+}
+MODEL_FILE_PATHS = {
+    RecognizerBackend.KERAS: MODEL_FILE_PATH,
+    RecognizerBackend.NUMPY: NUMPY_WEIGHTS_FILE_PATH,
+    RecognizerBackend.INT8: INT8_MODEL_FILE_PATH,
+}
+
+
+def get_files_size(path: str):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def get_resident_memory():
+    # the current resident set size of the process in bytes (Linux only)
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_memory():
+    # the peak resident set size of the process starts again from the current one (Linux only), so the memory
+    # taken by imports before the baseline is not counted as the peak of the model
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_memory():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def report_memory(name: str, batch_size: int):
+    # runs in a new process: prints the resident memory taken by loading the model and the peak of predicting
+    # a batch, both over the memory of the process with the runtime of the backend imported
+    if name == "keras":
+        import keras
+    elif name == "int8":
+        from int8_inference import get_interpreter_class
+        get_interpreter_class()
+    batch = np.random.default_rng(0).random((batch_size, 28, 28, 1), dtype=np.float32)
+    baseline = get_resident_memory()
+    reset_peak_memory()
+    recognizer = NumbersRecognizer(BACKENDS[name])
+    loaded = get_resident_memory()
+    recognizer.predict_batch(batch, batch_size)
+    peak = get_peak_memory()
+    if baseline is None or peak is None:
+        print(json.dumps({"model_bytes": None, "peak_bytes": None}))
+        return
+    print(json.dumps({"model_bytes": loaded - baseline, "peak_bytes": max(peak - baseline, loaded - baseline)}))
+
+
+def measure_memory(name: str, batch_size: int):
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_quantization", "--memory-of", name,
+                             "--batch-sizes", str(batch_size)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            check=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_latency(recognizer: NumbersRecognizer, inputs: np.ndarray, batch_size: int, repeats: int):
+    # every repeat predicts a different batch, the first batch is a warm-up
+    times = []
+    for i in range(repeats + 1):
+        start = (i * batch_size) % max(len(inputs) - batch_size, 1)
+        batch = np.ascontiguousarray(inputs[start:start+batch_size])
+        begin = time.perf_counter()
+        recognizer.predict_batch(batch, batch_size)
+        times.append(time.perf_counter() - begin)
+    return np.array(times[1:])
+
+
+def format_kilobytes(value):
+    return "-" if value is None else "%.1f" % (value / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, latency and memory of the int8 model against float32")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=["numpy", "int8"],
+                        help="keras needs TensorFlow")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 16, 256])
+    parser.add_argument("--repeats", type=int, default=20, help="batches timed per batch size")
+    parser.add_argument("--limit", type=int, default=0, help="test images to evaluate, 0 is all")
+    parser.add_argument("--output", default="bench_quantization.json")
+    parser.add_argument("--memory-of", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.memory_of is not None:
+        report_memory(args.memory_of, max(args.batch_sizes))
+        return
+
+    recognizers = {name: NumbersRecognizer.get_instance(BACKENDS[name]) for name in args.backends}
+    x_test, y_test = next(iter(recognizers.values())).get_test_data()
+    if args.limit > 0:
+        x_test, y_test = x_test[:args.limit], y_test[:args.limit]
+    labels = y_test.argmax(axis=1)
+
+    results = []
+    reference = None
+    print("%-6s %9s %9s %12s %12s %12s %s" % ("model", "accuracy", "agrees", "file, KB", "model, KB",
+                                              "peak, KB", " ".join("batch %d, ms" % size for size in args.batch_sizes)))
+    for name, recognizer in recognizers.items():
+        backend = BACKENDS[name]
+        start = time.perf_counter()
+        predicted = recognizer.predict_batch(x_test).argmax(axis=1)
+        evaluation_time = time.perf_counter() - start
+        reference = predicted if reference is None else reference
+        latency = {size: measure_latency(recognizer, x_test, size, args.repeats) for size in args.batch_sizes}
+        memory = measure_memory(name, max(args.batch_sizes))
+        result = {
+            "backend": name,
+            "accuracy": float((predicted == labels).mean()),
+            # the share of test images recognized as the same digits as by the first backend
+            "agreement": float((predicted == reference).mean()),
+            "evaluation_seconds": evaluation_time,
+            "images_per_second": len(x_test) / evaluation_time,
+            "latency_ms": {str(size): {"median": 1000 * float(np.median(times)),
+                                       "p95": 1000 * float(np.percentile(times, 95)),
+                                       "per_image": 1000 * float(np.median(times)) / size}
+                           for size, times in latency.items()},
+            "file_bytes": get_files_size(MODEL_FILE_PATHS[backend]),
+            "model_memory_bytes": memory["model_bytes"],
+            "peak_memory_bytes": memory["peak_bytes"],
+        }
+        results.append(result)
+        print("%-6s %9.4f %9.4f %12.1f %12s %12s %s"
+              % (name, result["accuracy"], result["agreement"], result["file_bytes"] / 1024,
+                 format_kilobytes(memory["model_bytes"]), format_kilobytes(memory["peak_bytes"]),
+                 " ".join("%13.2f" % result["latency_ms"][str(size)]["median"] for size in args.batch_sizes)))
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "test_images": len(x_test),
+        "parameters": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("saved to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# usage (from the repository root): python -m benchmarks.bench_service [--mode tensor] [--output bench_service.json]
+# a load generator for recognition_service.py: starts the service (or connects to a running one with --connect),
+# sends requests from many concurrent connections and reports throughput, tail latency and micro-batch sizes
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from numbers_recognition import NumbersRecognizer
+from recognition_service import DEFAULT_HOST, encode_request
+
+
+def make_requests(mode: str, count: int, digits: int, seed: int):
+    # payloads of requests: single normalized digits, or canvases of several test digits in a row
+    x_test, _ = NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend()).get_test_data()
+    rng = np.random.default_rng(seed)
+    requests = []
+    for i in range(count):
+        indices = np.sort(rng.choice(len(x_test), digits, replace=False))
+        if mode == "tensor":
+            requests.append(("tensor", np.asarray(x_test[indices], dtype=np.float32)))
+            continue
+        # black digits on white, twice as large as MNIST, 20 pixels apart
+        canvas = np.full((96, 20 + 76 * digits), 255, dtype=np.uint8)
+        for j, index in enumerate(indices):
+            digit = np.repeat(np.repeat(x_test[index], 2, axis=0), 2, axis=1)
+            canvas[20:76, 20 + 76 * j:76 + 76 * j] = 255 - np.round(digit * 255).astype(np.uint8)
+        requests.append(("image", canvas))
+    return requests
+
+
+async def run_load(host: str, port: int, requests: list, concurrency: int, options: dict):
+    # every connection sends a request, waits for its response and sends the next one
+    latencies = []
+    errors = 0
+    queue = list(enumerate(requests))[::-1]
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        while queue:
+            i, (kind, array) = queue.pop()
+            start = time.perf_counter()
+            writer.write(encode_request(i, kind, array, options if kind == "image" else None))
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            errors += "error" in response
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, np.array(latencies), errors
+
+
+async def get_stats(host: str, port: int):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_request("stats", "stats"))
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response["stats"]
+
+
+def wait_for_service(host: str, port: int, process, timeout: float = 120):
+    # the service accepts connections when its model is loaded
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("The service has exited with code %d" % process.returncode)
+        try:
+            return asyncio.run(get_stats(host, port))
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError("The service has not started in %d s" % timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and tail latency of the recognition service")
+    parser.add_argument("--mode", choices=["tensor", "image"], default="tensor")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64], help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--digits", type=int, default=1, help="digits per request")
+    parser.add_argument("--engine", default="components", help="segmentation engine of image requests")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--backend", help="model backend of the started service")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--connect", action="store_true", help="use a running service instead of starting one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_service.json")
+    args = parser.parse_args()
+
+    # the clusters count is not searched for, so requests of the same size take the same time
+    options = {"engine": args.engine, "auto_find_clusters_count": False, "clusters_count": args.digits}
+    process = None
+    if not args.connect:
+        command = [sys.executable, "recognition_service.py", "--port", str(args.port),
+                   "--max-batch-size", str(args.max_batch_size), "--max-wait-ms", str(args.max_wait_ms)]
+        if args.backend is not None:
+            command += ["--backend", args.backend]
+        process = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_service(DEFAULT_HOST, args.port, process)
+        results = []
+        print("%11s %10s %10s %10s %10s %10s %10s %7s" % ("concurrency", "req/s", "digits/s", "p50, ms", "p95, ms",
+                                                          "p99, ms", "batch", "errors"))
+        for i, concurrency in enumerate(args.concurrency):
+            # other digits for every level, the service caches predictions of the digits it has seen
+            requests = make_requests(args.mode, args.requests, args.digits, args.seed + i)
+            before = asyncio.run(get_stats(DEFAULT_HOST, args.port))
+            elapsed, latencies, errors = asyncio.run(run_load(DEFAULT_HOST, args.port, requests, concurrency,
+                                                              options))
+            after = asyncio.run(get_stats(DEFAULT_HOST, args.port))
+            batches = after["batches"] - before["batches"]
+            result = {
+                "concurrency": concurrency,
+                "requests": len(latencies),
+                "errors": errors,
+                "seconds": elapsed,
+                "requests_per_second": len(latencies) / elapsed,
+                "digits_per_second": len(latencies) * args.digits / elapsed,
+                "latency_ms": {name: 1000 * float(np.percentile(latencies, q))
+                               for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+                "batches": batches,
+                "mean_batch_size": (after["inputs"] - before["inputs"]) / batches if batches > 0 else 0.0,
+            }
+            results.append(result)
+            print("%11d %10.1f %10.1f %10.2f %10.2f %10.2f %10.1f %7d"
+                  % (concurrency, result["requests_per_second"], result["digits_per_second"],
+                     result["latency_ms"]["p50"], result["latency_ms"]["p95"], result["latency_ms"]["p99"],
+                     result["mean_batch_size"], errors))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("saved to", args.output)
+
+
+if __name__ == '__main__':
+    main()
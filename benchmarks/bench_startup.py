@@ -0,0 +1,26 @@
+# usage (from the repository root): python -m benchmarks.bench_startup
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    # the application reports its own import time, time to the first window and warm-up time
+    # when it is started with --startup-time, then it quits
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    for i in range(3):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "main.py", "--startup-time"], env=env, capture_output=True,
+                                text=True).stdout
+        elapsed = time.perf_counter() - start
+        for line in output.splitlines():
+            if "time" in line:
+                print(line)
+        print("process wall time: %.3f s" % elapsed)
+        print()
+
+
+if __name__ == '__main__':
+    main()
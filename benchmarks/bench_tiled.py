@@ -0,0 +1,131 @@
+# usage (from the repository root): python -m benchmarks.bench_tiled [--output bench_tiled.json]
+# writes a synthetic scan of an A3 page at 300 dpi (MNIST test digits and lines of a form) to a .npy file and
+# recognizes it tile by tile with several tile sizes and as a whole image: time, traced peak memory
+# (the memory-mapped page itself is not traced), digits found and their accuracy
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from cluster import Clusterizator, ConnectedComponentsEngine
+from numbers_recognition import NumbersRecognizer
+from prediction_cache import PredictionCache, predict_clusters
+from tiled import MAX_DIGIT_SIZE, recognize_page
+
+
+def make_page(file_path: str, x_test: np.ndarray, y_test: np.ndarray, width: int, height: int, digits: int,
+              seed: int):
+    # digits twice as large as MNIST in cells of a grid, so they never touch; returns {cell position: label}
+    rng = np.random.default_rng(seed)
+    page = np.lib.format.open_memmap(file_path, mode="w+", dtype=np.uint8, shape=(height, width))
+    page[:] = 255
+    cells = [(x, y) for y in range(40, height - 100, 100) for x in range(40, width - 100, 100)]
+    truth = {}
+    for i in rng.choice(len(cells), min(digits, len(cells)), replace=False):
+        x, y = cells[i]
+        index = rng.integers(len(x_test))
+        digit = np.repeat(np.repeat(x_test[index], 2, axis=0), 2, axis=1)
+        page[y:y + 56, x:x + 56] = 255 - np.round(digit * 255).astype(np.uint8)
+        truth[(x, y)] = int(y_test[index])
+    # lines of a form between the rows of digits, they are not digits
+    for y in range(118, height - 100, 500):
+        page[y:y + 3, 20:width - 20] = 0
+    page.flush()
+    return truth
+
+
+def score(digits: list, truth: dict):
+    # a digit is matched to the cell containing the center of its bounding box
+    found = correct = 0
+    for d in digits:
+        min_x, min_y, max_x, max_y = d["bbox"]
+        cx, cy = (min_x + max_x) // 2, (min_y + max_y) // 2
+        cell = (40 + (cx - 40) // 100 * 100, 40 + (cy - 40) // 100 * 100)
+        if cell in truth:
+            found += 1
+            correct += truth[cell] == d["digit"]
+    return found, correct
+
+
+def recognize_whole(page: np.ndarray, recognizer: NumbersRecognizer, dilation: int):
+    # the pipeline without tiles: the whole page is loaded and segmented at once
+    clusters = Clusterizator(np.asarray(page) < 255, ConnectedComponentsEngine(dilation)).clusterize(True, 1)
+    clusters = [c for c in clusters if max(c.max_x - c.min_x, c.max_y - c.min_y) <= MAX_DIGIT_SIZE]
+    _, predictions = predict_clusters(clusters, recognizer)
+    return [{"digit": int(p.argmax()), "bbox": [int(v) for v in c.get_bounding_box()]}
+            for c, p in zip(clusters, predictions)]
+
+
+def measure(func, *args):
+    PredictionCache.get_default().clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    digits = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return digits, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled recognition of a large page against the whole image")
+    parser.add_argument("--width", type=int, default=3508, help="page width in pixels")
+    parser.add_argument("--height", type=int, default=4961, help="page height in pixels")
+    parser.add_argument("--digits", type=int, default=1000)
+    parser.add_argument("--tile-sizes", nargs="+", type=int, default=[256, 512, 1024, 2048])
+    parser.add_argument("--dilation", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256, help="digits predicted at once")
+    parser.add_argument("--no-whole", action="store_true", help="do not recognize the whole image")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_tiled.json")
+    args = parser.parse_args()
+
+    recognizer = NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend())
+    x_test, y_test = recognizer.get_test_data()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "page.npy")
+        truth = make_page(file_path, x_test, y_test.argmax(axis=1), args.width, args.height, args.digits, args.seed)
+        page = np.load(file_path, mmap_mode="r")
+        # the runs take the page as an argument and keep no reference to it, the memory map is closed by del page
+        # before the temporary directory is removed
+        runs = [("tiles %d" % size, lambda page, size=size: list(recognize_page(page, recognizer, args.batch_size,
+                                                                                  tile_size=size,
+                                                                                  dilation=args.dilation)))
+                for size in args.tile_sizes]
+        if not args.no_whole:
+            runs.append(("whole", lambda page: recognize_whole(page, recognizer, args.dilation)))
+
+        print("%-12s %10s %12s %8s %8s %10s" % ("mode", "time, s", "peak, MB", "digits", "found", "accuracy"))
+        for name, func in runs:
+            digits, elapsed, peak = measure(func, page)
+            found, correct = score(digits, truth)
+            result = {"mode": name, "seconds": elapsed, "peak_memory_bytes": peak, "digits": len(digits),
+                      "found": found, "accuracy": correct / len(truth)}
+            results.append(result)
+            print("%-12s %10.2f %12.1f %8d %8d %10.3f" % (name, elapsed, peak / 2 ** 20, len(digits), found,
+                                                          result["accuracy"]))
+        del page
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": recognizer.get_backend().name,
+        "parameters": vars(args),
+        "placed_digits": len(truth),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("saved to", args.output)
+
+
+if __name__ == '__main__':
+    main()
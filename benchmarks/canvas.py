@@ -0,0 +1,68 @@
+import time
+import cv2
+import numpy as np
+from PyQt6.QtGui import QImage, QPainter, QPen, QColor
+
+
+def make_canvas(width: int, height: int, digits_count: int, seed: int = 0, pen_width: int = 2):
+    # draws digits_count random scribbles (one per cell of a grid) the same way ScenePainter draws lines,
+    # so that every scribble is a separate ink blob of roughly the size of a handwritten digit
+    rng = np.random.default_rng(seed)
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    image.fill(QColor(255, 255, 255, 255))
+
+    columns = int(np.ceil(np.sqrt(digits_count * width / height)))
+    rows = int(np.ceil(digits_count / columns))
+    cell_width, cell_height = width / columns, height / rows
+    size = min(cell_width, cell_height) * 0.6
+
+    painter = QPainter(image)
+    pen = QPen(QColor(0, 0, 0, 255))
+    pen.setWidth(pen_width)
+    painter.setPen(pen)
+    for i in range(digits_count):
+        cx = (i % columns + 0.5) * cell_width
+        cy = (i // columns + 0.5) * cell_height
+        # a smooth closed-ish curve with some noise, similar to a hand-drawn "0", "6", "8" etc.
+        t = np.linspace(0, 2 * np.pi * rng.uniform(0.8, 1.6), 60)
+        radius = size / 2 * (0.6 + 0.4 * np.sin(t * rng.integers(1, 4) + rng.uniform(0, np.pi)))
+        xs = cx + radius * np.cos(t) * rng.uniform(0.4, 0.8)
+        ys = cy + radius * np.sin(t)
+        for j in range(len(t) - 1):
+            painter.drawLine(int(xs[j]), int(ys[j]), int(xs[j + 1]), int(ys[j + 1]))
+    painter.end()
+    return image
+
+
+def make_mnist_canvas(images: np.ndarray, labels: np.ndarray, size: int = 56, spacing: int = 20, margin: int = 20,
+                      seed: int = 0):
+    # puts the given MNIST images (float, 0.0 is the background) in a row as black ink on a white canvas,
+    # returns the canvas, the matrix of true digit indices for every pixel (-1 is the background) and the digits
+    rng = np.random.default_rng(seed)
+    count = len(images)
+    width = count * size + (count - 1) * spacing + 2 * margin
+    height = size + 2 * margin
+    truth = np.full((height, width), -1, dtype=np.int32)
+    for i in range(count):
+        ink = cv2.resize(np.asarray(images[i], dtype=np.float32), (size, size),
+                         interpolation=cv2.INTER_LINEAR) >= 0.5
+        x = margin + i * (size + spacing)
+        y = margin + int(rng.integers(-margin // 2, margin // 2 + 1))
+        region = truth[y:y + size, x:x + size]
+        region[ink & (region < 0)] = i
+
+    colors = np.full((height, width, 4), 255, dtype=np.uint8)
+    colors[truth >= 0, :3] = 0
+    image = QImage(colors.data, width, height, width * 4, QImage.Format.Format_RGB32).copy()
+    return image, truth, np.asarray(labels[:count]).copy()
+
+
+def measure(func, repeat: int = 3):
+    # returns the best wall time of several runs, in seconds
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -1,37 +1,458 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from enum import Enum
+import logging
 import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score
+from sklearn.metrics import pairwise_distances_argmin, silhouette_score
 from kneed import KneeLocator
-from PyQt6.QtGui import QPixmap
+from scipy.ndimage import binary_dilation, label
+try:
+    from PyQt6.QtGui import QPixmap, QImage
+except ImportError:
+    # Qt is needed only to read points from Qt images, numpy arrays can be clusterized without it
+    QPixmap = QImage = None
+import metrics
+from strokes import StrokeModel
+
+logger = logging.getLogger(__name__)
 
 
 class Point(object):
-    def __init__(self, x: int, y: int):
+    def __init__(self, x: int, y: int, cluster_index: int = -1):
         self.x = x
         self.y = y
-        self.cluster_index = -1
+        self.cluster_index = cluster_index
 
 
 class PointsArray(object):
-    def __init__(self):
-        self.points = []
-        self.__features = []
+    # columnar storage of points: coordinates and cluster labels are kept in int32 arrays,
+    # Point objects are created only on demand as thin views.
+    # groups (optional) are segmentation hints: points of the same group (e.g. of the same stroke) should
+    # belong to the same cluster
+    def __init__(self, xs: np.ndarray = None, ys: np.ndarray = None, groups: np.ndarray = None):
+        self.xs = np.empty(0, dtype=np.int32) if xs is None else np.asarray(xs, dtype=np.int32)
+        self.ys = np.empty(0, dtype=np.int32) if ys is None else np.asarray(ys, dtype=np.int32)
+        self.labels = np.full(len(self.xs), -1, dtype=np.int32)
+        self.groups = None if groups is None else np.asarray(groups, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index: int):
+        return Point(int(self.xs[index]), int(self.ys[index]), int(self.labels[index]))
+
+    @property
+    def points(self):
+        return [self[i] for i in range(len(self))]
 
     def add(self, p: Point):
-        self.points.append(p)
-        self.__features.append([p.x, p.y])
+        self.add_coordinates(np.array([p.x]), np.array([p.y]))
+
+    def add_coordinates(self, xs: np.ndarray, ys: np.ndarray):
+        self.xs = np.concatenate((self.xs, np.asarray(xs, dtype=np.int32)))
+        self.ys = np.concatenate((self.ys, np.asarray(ys, dtype=np.int32)))
+        self.labels = np.concatenate((self.labels, np.full(len(xs), -1, dtype=np.int32)))
+        # the groups of new points are unknown
+        self.groups = None
 
     def get_features(self):
-        return np.array(self.__features)
+        return np.column_stack((self.xs, self.ys))
+
+    def set_labels(self, labels: np.ndarray, clusters_count: int):
+        # stores cluster labels of the points and splits the points into clusters
+        self.labels = np.asarray(labels, dtype=np.int32)
+        order = np.argsort(self.labels, kind="stable")
+        xs, ys = self.xs[order], self.ys[order]
+        bounds = np.searchsorted(self.labels[order], np.arange(clusters_count + 1))
+        return [Cluster(i, xs[bounds[i]:bounds[i + 1]], ys[bounds[i]:bounds[i + 1]])
+                for i in range(clusters_count)]
+
+
+class Cluster(object):
+    # points of a single cluster: views into the sorted coordinate arrays and a precomputed bounding box
+    def __init__(self, index: int, xs: np.ndarray, ys: np.ndarray):
+        self.index = index
+        self.xs = xs
+        self.ys = ys
+        if len(xs) > 0:
+            self.min_x, self.max_x = int(xs.min()), int(xs.max())
+            self.min_y, self.max_y = int(ys.min()), int(ys.max())
+        else:
+            self.min_x, self.max_x, self.min_y, self.max_y = 0, -1, 0, -1
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index: int):
+        return Point(int(self.xs[index]), int(self.ys[index]), self.index)
+
+    def __iter__(self):
+        for x, y in zip(self.xs.tolist(), self.ys.tolist()):
+            yield Point(x, y, self.index)
+
+    def get_bounding_box(self):
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+
+class ClusterizationEngine(object):
+    # base class of segmentation backends: an engine assigns a cluster label to every point and
+    # returns a tuple (labels, clusters count), or None if the clusters could not be found
+    def find_labels(self, points_array: PointsArray, auto_find_clusters_count: bool, clusters_count: int,
+                    progress_callback=None):
+        return None
+
+
+class SweepExecutor(Enum):
+    THREAD = 1
+    PROCESS = 2
+
+
+class SweepMode(Enum):
+    # FULL - every candidate clusters count is fitted from scratch with many random restarts
+    # INCREMENTAL - the solution for k + 1 clusters is seeded from the solution for k clusters by splitting
+    #               the worst cluster, random restarts stop once the inertia stabilises, and the search itself
+    #               stops as soon as the chosen clusters count does not change anymore
+    FULL = 1
+    INCREMENTAL = 2
+
+
+class ClustersCountPolicy(Enum):
+    # how the clusters count is chosen in the auto mode:
+    # ELBOW - by the elbow point of SSE values, silhouette coefficients are not calculated at all
+    # ELBOW_SILHOUETTE - by the elbow point, sampled silhouette coefficients are calculated for information only
+    # SILHOUETTE - by the maximum of sampled silhouette coefficients
+    ELBOW = 1
+    ELBOW_SILHOUETTE = 2
+    SILHOUETTE = 3
+
+
+def _get_silhouette_score(scaled_features: np.ndarray, labels: np.ndarray, n_clusters: int,
+                          silhouette_sample_size: int, random_state: int):
+    # Silhouette coefficient costs O(n^2) of the points count, so it is calculated on a random sample of points
+    # (if silhouette_sample_size is None then the coefficient is not calculated)
+    if silhouette_sample_size is None or not 1 < n_clusters < len(scaled_features):
+        return None
+    sample_size = min(silhouette_sample_size, len(scaled_features))
+    return silhouette_score(scaled_features, labels, sample_size=sample_size, random_state=random_state)
+
+
+def _fit_kmeans(scaled_features: np.ndarray, n_clusters: int, kmeans_kwargs: dict, silhouette_sample_size: int,
+                sample_weight: np.ndarray = None):
+    # a single step of the clusters count search, it is a module level function to be usable in a process pool,
+    # returns (SSE, silhouette coefficient, KMeans iterations)
+    kmeans = KMeans(n_clusters=n_clusters, **kmeans_kwargs)
+    kmeans.fit(scaled_features, sample_weight=sample_weight)
+    score = _get_silhouette_score(scaled_features, kmeans.labels_, n_clusters, silhouette_sample_size,
+                                  kmeans_kwargs.get("random_state"))
+    return kmeans.inertia_, score, kmeans.n_iter_
+
+
+def _split_worst_cluster(scaled_features: np.ndarray, sample_weight: np.ndarray, labels: np.ndarray,
+                         centers: np.ndarray, rng: np.random.Generator):
+    # returns k + 1 initial centers: the cluster with the largest SSE is replaced by two centers
+    # placed along its principal axis at one standard deviation from its centroid
+    sse = np.bincount(labels, weights=((scaled_features - centers[labels]) ** 2).sum(axis=1) * sample_weight,
+                      minlength=len(centers))
+    worst = int(sse.argmax())
+    points = scaled_features[labels == worst]
+    weights = sample_weight[labels == worst]
+    if len(points) < 2:
+        return np.vstack((centers, scaled_features[rng.integers(len(scaled_features))]))
+    _, singular_values, vt = np.linalg.svd((points - centers[worst]) * np.sqrt(weights)[:, np.newaxis],
+                                           full_matrices=False)
+    offset = vt[0] * singular_values[0] / np.sqrt(weights.sum())
+    return np.vstack((np.delete(centers, worst, axis=0), centers[worst] - offset, centers[worst] + offset))
+
+
+def _get_grid_coreset(features: np.ndarray, grid_step: int):
+    # points are grouped by cells of a grid with the given step, every non-empty cell is represented by
+    # the centroid of its points weighted by their count, so the coreset size depends on the grid resolution only
+    cells = features // grid_step
+    cells -= cells.min(axis=0)
+    keys = cells[:, 0].astype(np.int64) * (int(cells[:, 1].max()) + 1) + cells[:, 1]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    sums = np.column_stack((np.bincount(inverse, weights=features[:, 0]),
+                            np.bincount(inverse, weights=features[:, 1])))
+    return sums / counts[:, np.newaxis], counts.astype(np.float64)
+
+
+def _vote_groups(labels: np.ndarray, groups: np.ndarray):
+    # all points of a group get the label of the majority of the group points, clusters which have lost
+    # all their points are removed; returns (labels, clusters count)
+    _, groups = np.unique(groups, return_inverse=True)
+    nclusters = int(labels.max()) + 1
+    votes = np.bincount(groups.astype(np.int64) * nclusters + labels,
+                        minlength=(int(groups.max()) + 1) * nclusters).reshape(-1, nclusters)
+    labels = votes.argmax(axis=1)[groups]
+    used, labels = np.unique(labels, return_inverse=True)
+    return labels.astype(np.int32), len(used)
 
 
 # see: https://realpython.com/k-means-clustering-python/
 #      https://www.dominodatalab.com/blog/getting-started-with-k-means-clustering-in-python
+class KMeansEngine(ClusterizationEngine):
+    # the clusters count search fits one KMeans per candidate count, the candidates are independent of each other,
+    # so they may be fitted concurrently by `workers` threads or processes (workers = 1 means serial search).
+    # The incremental search is sequential by nature, so it does not use workers
+    def __init__(self, workers: int = 1, executor: SweepExecutor = SweepExecutor.THREAD,
+                 policy: ClustersCountPolicy = ClustersCountPolicy.ELBOW, silhouette_sample_size: int = 2000,
+                 mode: SweepMode = SweepMode.FULL, max_restarts: int = 10, restarts_tolerance: float = 1e-3,
+                 patience: int = 3, flat_tolerance: float = 0.01, grid_step: int = 1, use_groups: bool = True):
+        self.__workers = workers
+        self.__executor = executor
+        self.__policy = policy
+        self.__silhouette_sample_size = silhouette_sample_size
+        self.__mode = mode
+        self.__max_restarts = max_restarts
+        self.__restarts_tolerance = restarts_tolerance
+        self.__patience = patience
+        self.__flat_tolerance = flat_tolerance
+        self.__grid_step = grid_step
+        # if points have groups (pieces of strokes), a group is never split between clusters
+        self.__use_groups = use_groups
+
+    def find_labels(self, points_array: PointsArray, auto_find_clusters_count: bool, clusters_count: int,
+                    progress_callback=None):
+        # if auto_find_clusters_count is True then clusters_count represents MAX clusters count
+        # otherwise it is just the fixed count of clusters to recognize
+        rs = self.__find_labels(points_array, auto_find_clusters_count, clusters_count, progress_callback)
+        if rs is not None and self.__use_groups and points_array.groups is not None:
+            rs = _vote_groups(rs[0], points_array.groups)
+        return rs
+
+    def __find_labels(self, points_array: PointsArray, auto_find_clusters_count: bool, clusters_count: int,
+                      progress_callback):
+        # preprocess data, so that the features have a mean of 0 and standard deviation of 1
+        scaler = StandardScaler()
+        features = points_array.get_features()
+        scaled_features = scaler.fit_transform(features)
+
+        # clustering is done on the (weighted) coreset, labels of all points are their nearest centroids
+        if self.__grid_step > 1:
+            coreset, sample_weight = _get_grid_coreset(features, self.__grid_step)
+            coreset = scaler.transform(coreset)
+            logger.debug("coreset size: %d of %d", len(coreset), len(features))
+            metrics.count("coreset_points", len(coreset))
+        else:
+            coreset, sample_weight = scaled_features, None
+
+        kmeans_kwargs = {
+            "init": "random",
+            "n_init": 100,
+            "max_iter": 3000,
+            "random_state": 42,
+        }
+
+        # there cannot be more clusters than points
+        nclusters = min(clusters_count, len(coreset))
+
+        if auto_find_clusters_count and nclusters > 1:
+            max_steps = nclusters
+            with metrics.span("k_search"):
+                if self.__mode == SweepMode.INCREMENTAL:
+                    sse, silhouette_coefficients, centers, nclusters = \
+                        self.__incremental_sweep(coreset, sample_weight, max_steps, kmeans_kwargs, progress_callback)
+                else:
+                    results = self.__sweep(coreset, sample_weight, range(1, max_steps+1), kmeans_kwargs,
+                                           progress_callback)
+                    sse = [results[i][0] for i in range(1, max_steps+1)]
+                    silhouette_coefficients = [results[i][1] for i in range(2, max_steps+1)]
+                    nclusters = None
+                metrics.count("k_tried", len(sse))
+                logger.debug("sse: %s", sse)
+                if self.__policy != ClustersCountPolicy.ELBOW:
+                    logger.debug("silhouette_coefficients: %s", silhouette_coefficients)
+                if nclusters is None:
+                    nclusters = self.__choose_clusters_count(sse, silhouette_coefficients)
+            logger.debug("chosen clusters count: %s", nclusters)
+            if nclusters is None:
+                logger.info("Elbow point not found")
+                return None
+            if self.__mode == SweepMode.INCREMENTAL:
+                # the solution for the chosen count is already known, labels are the nearest centroids
+                return self.__nearest_centers(scaled_features, centers[nclusters]), nclusters
+
+        with metrics.span("kmeans_fit"):
+            kmeans = KMeans(n_clusters=nclusters, **kmeans_kwargs)
+            kmeans.fit(coreset, sample_weight=sample_weight)
+        metrics.count("kmeans_fits")
+        metrics.count("kmeans_iterations", int(kmeans.n_iter_))
+        # the arguments are formatted only if the debug level is enabled
+        logger.debug("kmeans.n_clusters: %d", kmeans.n_clusters)
+        logger.debug("The lowest SSE value: %s", kmeans.inertia_)
+        logger.debug("Final locations of the centroids: %s", kmeans.cluster_centers_)
+        logger.debug("The number of iterations required to converge: %d", kmeans.n_iter_)
+        logger.debug("the cluster assignments: %s", kmeans.labels_)
+
+        if self.__grid_step > 1:
+            return self.__nearest_centers(scaled_features, kmeans.cluster_centers_), nclusters
+        return kmeans.labels_, nclusters
+
+    def __choose_clusters_count(self, sse, silhouette_coefficients):
+        # sse[i] and silhouette_coefficients[i - 1] correspond to i + 1 clusters,
+        # the silhouette coefficient is not defined if there are not more points than clusters, it is -1 at worst
+        if self.__policy == ClustersCountPolicy.SILHOUETTE:
+            scores = np.array([-1.0 if c is None else c for c in silhouette_coefficients])
+            return int(scores.argmax()) + 2 if len(scores) > 0 else None
+        # search for elbow point
+        if len(sse) < 3:
+            return None
+        knee_locator = KneeLocator(
+            range(1, len(sse)+1), sse, curve="convex", direction="decreasing"
+        )
+        return knee_locator.elbow
+
+    def __sweep(self, scaled_features: np.ndarray, sample_weight: np.ndarray, counts, kmeans_kwargs: dict,
+                progress_callback):
+        # returns {clusters count: (sse, silhouette coefficient)}, the results do not depend on the count of workers
+        silhouette_sample_size = None if self.__policy == ClustersCountPolicy.ELBOW else self.__silhouette_sample_size
+        results = {}
+        if self.__workers <= 1:
+            for i in counts:
+                logger.debug("precalculate k-means, iteration = %d", i)
+                if progress_callback is not None and callable(progress_callback):
+                    progress_callback(int(i / len(counts) * 100))
+                results[i] = _fit_kmeans(scaled_features, i, kmeans_kwargs, silhouette_sample_size, sample_weight)
+                metrics.count("kmeans_fits")
+                metrics.count("kmeans_iterations", int(results[i][2]))
+            return results
+
+        pool_class = ThreadPoolExecutor if self.__executor == SweepExecutor.THREAD else ProcessPoolExecutor
+        pool = pool_class(max_workers=self.__workers)
+        try:
+            # the most expensive (largest) counts go first, so that they do not delay the end of the search
+            futures = {pool.submit(_fit_kmeans, scaled_features, i, kmeans_kwargs, silhouette_sample_size,
+                                   sample_weight): i
+                       for i in reversed(counts)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                # counted here, in the calling thread, the fits may run in other processes
+                metrics.count("kmeans_fits")
+                metrics.count("kmeans_iterations", int(results[futures[future]][2]))
+                logger.debug("precalculate k-means, iteration = %d", futures[future])
+                if progress_callback is not None and callable(progress_callback):
+                    progress_callback(int(len(results) / len(counts) * 100))
+        except BaseException:
+            # e.g. the progress callback has cancelled the search: do not wait for the pending fits
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return results
+
+    def __incremental_sweep(self, scaled_features: np.ndarray, sample_weight: np.ndarray, max_steps: int,
+                            kmeans_kwargs: dict, progress_callback):
+        # returns SSE values, silhouette coefficients and {clusters count: centers} of the counts tried,
+        # and the chosen clusters count if the search has been stopped early (otherwise None)
+        silhouette_sample_size = None if self.__policy == ClustersCountPolicy.ELBOW else self.__silhouette_sample_size
+        rng = np.random.default_rng(kmeans_kwargs["random_state"])
+        max_iter = kmeans_kwargs["max_iter"]
+
+        weights = np.ones(len(scaled_features)) if sample_weight is None else sample_weight
+        centers = {1: np.average(scaled_features, axis=0, weights=weights)[np.newaxis, :]}
+        labels = np.zeros(len(scaled_features), dtype=np.int32)
+        sse = [float((((scaled_features - centers[1]) ** 2).sum(axis=1) * weights).sum())]
+        silhouette_coefficients = []
+        choices = []
+        early_choice = None
+        for i in range(2, min(max_steps, len(scaled_features)) + 1):
+            logger.debug("precalculate k-means, iteration = %d", i)
+            if progress_callback is not None and callable(progress_callback):
+                progress_callback(int(i / max_steps * 100))
+
+            # warm start from the previous solution
+            init = _split_worst_cluster(scaled_features, weights, labels, centers[i - 1], rng)
+            best = KMeans(n_clusters=i, init=init, n_init=1, max_iter=max_iter).fit(scaled_features,
+                                                                                   sample_weight=sample_weight)
+            fits, iterations = 1, best.n_iter_
+            # adaptive random restarts: stop once the best inertia does not improve noticeably
+            stale = 0
+            for restart in range(self.__max_restarts):
+                if stale >= 2:
+                    break
+                kmeans = KMeans(n_clusters=i, init="k-means++", n_init=1, max_iter=max_iter,
+                                random_state=int(rng.integers(2 ** 31 - 1))).fit(scaled_features,
+                                                                                 sample_weight=sample_weight)
+                fits, iterations = fits + 1, iterations + kmeans.n_iter_
+                if kmeans.inertia_ < best.inertia_ * (1 - self.__restarts_tolerance):
+                    best, stale = kmeans, 0
+                else:
+                    stale += 1
+
+            metrics.count("kmeans_fits", fits)
+            metrics.count("kmeans_iterations", int(iterations))
+            centers[i], labels = best.cluster_centers_, best.labels_
+            sse.append(best.inertia_)
+            silhouette_coefficients.append(_get_silhouette_score(scaled_features, labels, i, silhouette_sample_size,
+                                                                 kmeans_kwargs["random_state"]))
+
+            # early stop once the choice is unambiguous. For the elbow it is when the SSE curve has become flat:
+            # the last `patience` decreases of SSE are all less than flat_tolerance of the total SSE,
+            # then the elbow is the count where the flat part starts (the elbow of a truncated curve found by
+            # KneeLocator moves towards the end of the curve, so it is not used here).
+            # For the silhouette it is when the best count has not changed for `patience` steps
+            # and the curve is known far enough beyond it
+            if self.__policy == ClustersCountPolicy.SILHOUETTE:
+                choices.append(self.__choose_clusters_count(sse, silhouette_coefficients))
+                recent = choices[-self.__patience:]
+                if len(recent) == self.__patience and recent.count(recent[0]) == len(recent) \
+                        and i >= max(2 * recent[0], recent[0] + self.__patience):
+                    logger.debug("the clusters count search is stopped early at %d", i)
+                    early_choice = recent[0]
+                    break
+            elif len(sse) > self.__patience and \
+                    (-np.diff(sse[-self.__patience - 1:]) < self.__flat_tolerance * sse[0]).all():
+                logger.debug("the clusters count search is stopped early at %d", i)
+                early_choice = i - self.__patience
+                break
+
+        if progress_callback is not None and callable(progress_callback):
+            progress_callback(100)
+        return sse, silhouette_coefficients, centers, early_choice
+
+    @staticmethod
+    def __nearest_centers(scaled_features: np.ndarray, centers: np.ndarray):
+        # the distances are computed by chunks of points, only a chunk of the (points, centers) matrix is in memory
+        return pairwise_distances_argmin(scaled_features, centers).astype(np.int32)
+
+
+class ConnectedComponentsEngine(ClusterizationEngine):
+    # separate handwritten digits are usually separate ink blobs, so every 8-connected component of the ink
+    # is a cluster; the ink may be dilated by `dilation` pixels before labelling to merge broken strokes.
+    # The count of clusters is defined by the image itself, so clusters_count is not used
+    def __init__(self, dilation: int = 0):
+        self.__dilation = dilation
+
+    def find_labels(self, points_array: PointsArray, auto_find_clusters_count: bool, clusters_count: int,
+                    progress_callback=None):
+        # draw the points on a mask of their bounding box (with a margin for the dilation)
+        min_x = int(points_array.xs.min()) - self.__dilation
+        min_y = int(points_array.ys.min()) - self.__dilation
+        width = int(points_array.xs.max()) - min_x + self.__dilation + 1
+        height = int(points_array.ys.max()) - min_y + self.__dilation + 1
+        mask = np.zeros((height, width), dtype=bool)
+        mask[points_array.ys - min_y, points_array.xs - min_x] = True
+
+        structure = np.ones((3, 3), dtype=bool)
+        if self.__dilation > 0:
+            mask = binary_dilation(mask, structure=structure, iterations=self.__dilation)
+        components, nclusters = label(mask, structure=structure)
+        logger.debug("connected components found: %d", nclusters)
+        if progress_callback is not None and callable(progress_callback):
+            progress_callback(100)
+
+        # component indices start from 1, 0 is the background
+        return components[points_array.ys - min_y, points_array.xs - min_x] - 1, nclusters
+
+
 class Clusterizator(object):
-    def __init__(self, pixmap: QPixmap):
+    def __init__(self, pixmap: "QPixmap", engine: ClusterizationEngine = None):
+        # pixmap may be a QImage as well (pixmaps cannot be used outside the GUI thread), a numpy array
+        # (see get_array_ink_coordinates) or a StrokeModel; arrays and strokes do not need Qt at all,
+        # strokes also give the groups of points
         self.__points_array = PointsArray()
         self.__pixmap = pixmap
+        self.__engine = engine if engine is not None else KMeansEngine()
         self.__progress_callback = None
         self.__prepare_data()
 
@@ -42,92 +463,65 @@ class Clusterizator(object):
         # if auto_find_clusters_count is True then clusters_count represents MAX clusters count
         # otherwise it is just the fixed count of clusters to recognize
 
-        if len(self.__points_array.points) == 0 or clusters_count == 0:
-            print("No points found, nothing to do")
+        if len(self.__points_array) == 0 or clusters_count == 0:
+            logger.info("No points found, nothing to do")
             return []
 
-        # preprocess data, so that the features have a mean of 0 and standard deviation of 1
-        scaler = StandardScaler()
-        scaled_features = scaler.fit_transform(self.__points_array.get_features())
-
-        kmeans_kwargs = {
-            "init": "random",
-            "n_init": 100,
-            "max_iter": 3000,
-            "random_state": 42,
-        }
-
-        nclusters = clusters_count
-
-        if auto_find_clusters_count and clusters_count > 1:
-            sse = []
-            silhouette_coefficients = []
-            max_steps = clusters_count
-            for i in range(1, max_steps+1):
-                print("precalculate k-means, iteration = ", i)
-                if self.__progress_callback is not None and callable(self.__progress_callback):
-                    self.__progress_callback(int(i / max_steps * 100))
-                kmeans = KMeans(n_clusters=i, **kmeans_kwargs)
-                kmeans.fit(scaled_features)
-                sse.append(kmeans.inertia_)
-                if i > 1:
-                    score = silhouette_score(scaled_features, kmeans.labels_)
-                    silhouette_coefficients.append(score)
-            # search for elbow point
-            print("sse:", sse)
-            print("calculate elbow point..")
-            knee_locator = KneeLocator(
-                range(1, max_steps+1), sse, curve="convex", direction="decreasing"
-            )
-            print("knee_locator.elbow:", knee_locator.elbow)
-            print("silhouette_coefficients:", silhouette_coefficients)
-            print("max silhouette_coefficients:", np.array(silhouette_coefficients).argmax() + 2)
-            if knee_locator.elbow is None:
-                print("Elbow point not found")
+        with metrics.span("clustering"):
+            rs = self.__engine.find_labels(self.__points_array, auto_find_clusters_count, clusters_count,
+                                           self.__progress_callback)
+            if rs is None:
                 return []
-            nclusters = knee_locator.elbow
-
-        kmeans = KMeans(n_clusters=nclusters, **kmeans_kwargs)
-        kmeans.fit(scaled_features)
-        print("kmeans.n_clusters:", kmeans.n_clusters)
-        print("The lowest SSE value:", kmeans.inertia_)
-        print("Final locations of the centroids:", kmeans.cluster_centers_)
-        print("The number of iterations required to converge:", kmeans.n_iter_)
-        print("the cluster assignments:", kmeans.labels_)
-
-        # generate results
-        rs_clusters = []
-        for i in range(nclusters):
-            rs_clusters.append([])
-        for i in range(len(kmeans.labels_)):
-            cluster_index = kmeans.labels_[i]
-            self.__points_array.points[i].cluster_index = cluster_index
-            rs_clusters[cluster_index].append(self.__points_array.points[i])
-
-        return rs_clusters
+            labels, nclusters = rs
+
+            # generate results
+            clusters = self.__points_array.set_labels(labels, nclusters)
+        metrics.count("clusters", len(clusters))
+        return clusters
 
     def __prepare_data(self):
-        # 1. transform image to a matrix with values: 0.0 if the color is white, 1.0 if the color is black
-        #    (for simplicity, assume that we have only 2 colors in the image)
-        transform_func = lambda c: \
-            0.0 if c[0][0] == 255 else \
-                1.0 if c[0][0] == 0 else \
-                    (c[0][0] + c[0][1] + c[0][2]) / 3 / 255
-        transform_func_vec = np.vectorize(transform_func, signature="(n,m)->()")
-
-        image = self.__pixmap.toImage()
-        ptr = image.bits()
-        ptr.setsize(image.sizeInBytes())
-        # convert the image to vector of color (QColor) arrays consisting of 4 elems (red, green, blue, alpha)
-        image_vector = np.asarray(ptr).reshape(image.height() * image.width(), 1, 4)
-        # transform color arrays to single float values in a range [0.0, 1.0]
-        rs = transform_func_vec(image_vector)
-        # transform result vector back to array (matrix) of image size
-        rs = rs.reshape(image.height(), image.width())
-
-        # 2. for clusterization we do not need to have a matrix, we need a vector of non-empty (non-white) points,
-        #    so now we are transforming the result image matrix into a vector of non-empty points:
-        for i in range(image.height()):
-            for j in range(image.width()):
-                if rs[i, j] != 0.0:
-                    self.__points_array.add(Point(j, i))
+        with metrics.span("extraction"):
+            groups = None
+            if isinstance(self.__pixmap, StrokeModel):
+                xs, ys, groups = self.__pixmap.get_ink()
+            elif isinstance(self.__pixmap, np.ndarray):
+                xs, ys = get_array_ink_coordinates(self.__pixmap)
+            else:
+                image = self.__pixmap.toImage() if isinstance(self.__pixmap, QPixmap) else self.__pixmap
+                xs, ys = get_ink_coordinates(image)
+            self.__points_array = PointsArray(xs, ys, groups)
+        metrics.count("points", len(self.__points_array))
+
+
+def get_color_matrix(image: "QImage"):
+    # view the image buffer as a (height, width, 4) matrix of color components (blue, green, red, alpha)
+    # without copying, rows may be padded, so the bytes per line have to be respected
+    if image.format() not in (QImage.Format.Format_RGB32, QImage.Format.Format_ARGB32):
+        # the matrix is a view of the converted image, so it has to be copied while the image is alive
+        converted = image.convertToFormat(QImage.Format.Format_RGB32)
+        return get_color_matrix(converted).copy()
+    ptr = image.bits()
+    ptr.setsize(image.sizeInBytes())
+    buffer = np.frombuffer(ptr, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return buffer[:, :image.width() * 4].reshape(image.height(), image.width(), 4)
+
+
+def get_ink_coordinates(image: "QImage"):
+    # for clusterization we do not need to have a matrix, we need vectors of coordinates of non-empty (non-white)
+    # points; the canvas has only black ink on white, so a point is empty exactly when its first color component
+    # is 255
+    ys, xs = np.nonzero(get_color_matrix(image)[:, :, 0] != 255)
+    return xs.astype(np.int32), ys.astype(np.int32)
+
+
+def get_array_ink_coordinates(image: np.ndarray):
+    # the same as get_ink_coordinates, but for images which are not Qt ones: a boolean matrix is an ink mask itself,
+    # a grayscale (height, width) or color (height, width, channels) matrix has ink where the color is not white
+    if image.dtype == np.bool_:
+        mask = image
+    elif image.ndim == 3:
+        mask = (np.asarray(image)[:, :, :3] != 255).any(axis=2)
+    else:
+        mask = np.asarray(image) != 255
+    ys, xs = np.nonzero(mask)
+    return xs.astype(np.int32), ys.astype(np.int32)
@@ -1,105 +1,96 @@
-from scipy.ndimage import center_of_mass
 import cv2
-import math
 import numpy as np
-from PyQt6.QtGui import QPainter, QPixmap, QPen, QImage, QColor, QBrush
-from PyQt6 import QtCore
-
+from cluster import Cluster
 
 
 class ImageConverter(object):
-    def __init__(self, points):
+    # converts a cluster of points to an image in the MNIST format with NumPy (and OpenCV for scaling) only,
+    # see convert_batch() to convert many clusters at once
+    def __init__(self, points: Cluster):
         self.__image = self.__get_image_for_points(points)
         # mnist images of numbers are 28x28, but the pictures themselves are contained in the centre rectangle 20x20
         self.__image = self.__scale_image(self.__image, 20, 20)
-        self.__data_array = self.__prepare_image_for_mnist(self.__image)
+        self.__data_array = self.__prepare_images_for_mnist([self.__image])
 
     def get_image(self):
+        # the scaled grayscale image (uint8, black on white)
         return self.__image
 
     def get_data(self):
         return self.__data_array
 
-    def __get_image_for_points(self, points):
-        # 1. Get min and max coordinates
-        min_x, min_y = points[0].x, points[0].y
-        max_x, max_y = points[0].x, points[0].y
-        for i in range(len(points)):
-            if points[i].x < min_x:
-                min_x = points[i].x
-            if points[i].y < min_y:
-                min_y = points[i].y
-            if points[i].x > max_x:
-                max_x = points[i].x
-            if points[i].y > max_y:
-                max_y = points[i].y
-
-        # 2. Shift all pointes to the 0-point of coordinates axes
-        shifted_coords = []
-        for i in range(len(points)):
-            shifted_coords.append([points[i].x - min_x, points[i].y - min_y])
-
-        width = max_x - min_x
-        height = max_y - min_y
+    @staticmethod
+    def convert_batch(clusters: list):
+        # returns a (n, 28, 28, 1) array of data for all clusters and a list of their scaled images
+        images = [ImageConverter.__scale_image(ImageConverter.__get_image_for_points(points), 20, 20)
+                  for points in clusters]
+        return ImageConverter.__prepare_images_for_mnist(images), images
 
-        # 3. Finally, draw an image
-        pixmap = QPixmap(width, height)
-        painter = QPainter(pixmap)
-        pen = QPen(QColor(0, 0, 0, 255))
-        pen.setWidth(2)
-        brush = QBrush(QColor(255, 255, 255, 255))
-        painter.setPen(pen)
-        painter.setBrush(brush)
-        painter.fillRect(0, 0, width, height, brush)
-        for i in range(len(shifted_coords)):
-            painter.drawPoint(shifted_coords[i][0], shifted_coords[i][1])
-        painter.end()
+    @staticmethod
+    def __get_image_for_points(points: Cluster):
+        # 1. Get min and max coordinates (they are precomputed for a cluster)
+        min_x, min_y, max_x, max_y = points.get_bounding_box()
 
-        return QImage(pixmap)
-
-    def __scale_image(self, image: QImage, width: int, height: int):
-        image = image.scaled(width, height,
-                             QtCore.Qt.AspectRatioMode.KeepAspectRatio,
-                             QtCore.Qt.TransformationMode.SmoothTransformation)
+        # 2. Shift all pointes to the 0-point of coordinates axes
+        width = max(max_x - min_x, 1)
+        height = max(max_y - min_y, 1)
+        xs = points.xs - min_x
+        ys = points.ys - min_y
+
+        # 3. Finally, draw an image: every point is drawn as a 2x2 square (as a point drawn by a pen of width 2)
+        image = np.full((height, width), 255, dtype=np.uint8)
+        for dx in (-1, 0):
+            for dy in (-1, 0):
+                visible = (xs + dx >= 0) & (xs + dx < width) & (ys + dy >= 0) & (ys + dy < height)
+                image[ys[visible] + dy, xs[visible] + dx] = 0
         return image
 
-    def __shift_image_to_center_of_mass(self, img):
-        cy, cx = center_of_mass(img)
-        rows, cols = img.shape
-        shiftx = np.round(cols / 2.0 - cx).astype(int)
-        shifty = np.round(rows / 2.0 - cy).astype(int)
-
-        rows, cols = img.shape
-        m = np.float32([[1, 0, shiftx], [0, 1, shifty]])
-        shifted = cv2.warpAffine(img, m, (cols, rows))
-        return shifted
-
-    def __prepare_image_for_mnist(self, image: QImage):
-        if image.width() > 20 or image.height() > 20:
-            raise Exception("Wrong image size! It should be 20x20 maximum!")
-
-        transform_func = lambda c: int(255 - (int(c[0][0]) + int(c[0][1]) + int(c[0][2])) / 3)
-        transform_func_vec = np.vectorize(transform_func, signature="(n,m)->()")
-
-        threshold_func = lambda c: 255 if c >= 64 else 0
-        threshold_func_vec = np.vectorize(threshold_func)
-
-        ptr = image.bits()
-        ptr.setsize(image.sizeInBytes())
-        # convert the image to vector of color (QColor) arrays consisting of 4 elems (red, green, blue, alpha)
-        image_vector = np.asarray(ptr).reshape(image.height() * image.width(), 1, 4)
-
-        rs = transform_func_vec(image_vector)
-        rs = threshold_func_vec(rs)
-        rs = rs / 255.0
-        # transform result vector back to array (matrix) of image size
-        rs = rs.reshape(image.height(), image.width())
-
-        rows, cols = rs.shape
-        cols_padding = (int(math.ceil((28 - cols) / 2.0)), int(math.floor((28 - cols) / 2.0)))
-        rows_padding = (int(math.ceil((28 - rows) / 2.0)), int(math.floor((28 - rows) / 2.0)))
-        rs = np.lib.pad(rs, (rows_padding, cols_padding), 'constant')
-
-        rs = self.__shift_image_to_center_of_mass(rs)
-
-        return np.array(rs).reshape(-1, 28, 28, 1)
+    @staticmethod
+    def __scale_image(image: np.ndarray, width: int, height: int):
+        # keep the aspect ratio: the image is scaled to fit into width x height
+        rows, cols = image.shape
+        scaled_cols = height * cols // rows
+        if scaled_cols <= width:
+            size = (max(scaled_cols, 1), height)
+        else:
+            size = (width, max(width * rows // cols, 1))
+        # area averaging is the smooth transformation for shrinking, bilinear one - for enlarging
+        interpolation = cv2.INTER_AREA if size[0] < cols else cv2.INTER_LINEAR
+        return cv2.resize(image, size, interpolation=interpolation)
+
+    @staticmethod
+    def __prepare_images_for_mnist(images: list):
+        count = len(images)
+        rs = np.zeros((count, 28, 28), dtype=np.float32)
+        for i, image in enumerate(images):
+            rows, cols = image.shape
+            if cols > 20 or rows > 20:
+                raise Exception("Wrong image size! It should be 20x20 maximum!")
+            # invert the image (the digit should be white on black) and apply the threshold,
+            # the image is padded to 28x28
+            top = (28 - rows + 1) // 2
+            left = (28 - cols + 1) // 2
+            rs[i, top:top + rows, left:left + cols] = (255 - image.astype(np.int32)) >= 64
+
+        # shift images to their centers of mass
+        mass = rs.sum(axis=(1, 2))
+        coordinates = np.arange(28, dtype=np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cy = np.where(mass > 0, (rs.sum(axis=2) * coordinates).sum(axis=1) / mass, 13.5)
+            cx = np.where(mass > 0, (rs.sum(axis=1) * coordinates).sum(axis=1) / mass, 13.5)
+        shifty = np.round(28 / 2.0 - cy).astype(int)
+        shiftx = np.round(28 / 2.0 - cx).astype(int)
+        source_rows = coordinates.astype(int)[np.newaxis, :] - shifty[:, np.newaxis]
+        source_cols = coordinates.astype(int)[np.newaxis, :] - shiftx[:, np.newaxis]
+        valid = ((source_rows >= 0) & (source_rows < 28))[:, :, np.newaxis] & \
+                ((source_cols >= 0) & (source_cols < 28))[:, np.newaxis, :]
+        shifted = rs[np.arange(count)[:, np.newaxis, np.newaxis],
+                     np.clip(source_rows, 0, 27)[:, :, np.newaxis],
+                     np.clip(source_cols, 0, 27)[:, np.newaxis, :]]
+        shifted[~valid] = 0.0
+
+        return shifted.reshape(-1, 28, 28, 1)
+
+
+def save_image(file_path: str, image: np.ndarray):
+    cv2.imwrite(file_path, image)
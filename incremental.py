@@ -0,0 +1,81 @@
+# incremental re-recognition: when the drawing has only been extended since the previous run, clusters far
+# from everything drawn or erased since then are kept with their predictions, only the ink near the changes
+# is segmented and classified again
+import logging
+import numpy as np
+import metrics
+from cluster import PointsArray, ConnectedComponentsEngine
+from strokes import StrokeModel
+
+logger = logging.getLogger(__name__)
+
+# ink closer than this to a change may belong to the same digit as the changed ink
+DIRTY_MARGIN = 10
+# gaps between strokes of one digit, used to count digits in the ink to segment again
+DIGIT_GAP = 5
+
+
+class RecognitionResult(object):
+    # everything needed to continue from a finished run; settings are compared as a whole,
+    # a run with other settings is never incremental
+    def __init__(self, strokes: StrokeModel, settings, clusters: list, images: list, predictions: np.ndarray):
+        self.strokes = strokes
+        self.settings = settings
+        self.clusters = clusters
+        self.images = images
+        self.predictions = predictions
+
+
+def segment_incrementally(previous: RecognitionResult, strokes: StrokeModel, engine,
+                          auto_find_clusters_count: bool, clusters_count: int, margin: int = DIRTY_MARGIN):
+    # returns indices of the kept clusters of the previous result and the new clusters,
+    # or None if the whole drawing has to be recognized again
+    dirty_rects = strokes.get_dirty_rects(previous.strokes)
+    if dirty_rects is None:
+        return None
+    if len(dirty_rects) == 0:
+        return list(range(len(previous.clusters))), []
+
+    dirty_rects = np.array(dirty_rects) + np.array([-margin, -margin, margin, margin])
+    kept = []
+    for i, cluster in enumerate(previous.clusters):
+        min_x, min_y, max_x, max_y = cluster.get_bounding_box()
+        touched = (dirty_rects[:, 0] <= max_x) & (dirty_rects[:, 2] >= min_x) & \
+                  (dirty_rects[:, 1] <= max_y) & (dirty_rects[:, 3] >= min_y)
+        if not touched.any():
+            kept.append(i)
+    # nothing to keep: it is not cheaper than the full run, and the full run chooses the clusters count better
+    if len(kept) == 0:
+        return None
+    if not auto_find_clusters_count and clusters_count - len(kept) < 1:
+        return None
+    metrics.count("clusters_kept", len(kept))
+
+    # the ink of kept clusters has not changed, everything else is segmented again
+    with metrics.span("extraction"):
+        xs, ys, groups = strokes.get_ink()
+        width, height = strokes.get_size()
+        kept_mask = np.zeros((height, width), dtype=bool)
+        for i in kept:
+            kept_mask[previous.clusters[i].ys, previous.clusters[i].xs] = True
+        dirty = ~kept_mask[ys, xs]
+        points_array = PointsArray(xs[dirty], ys[dirty], groups[dirty])
+    metrics.count("points", len(points_array))
+    logger.debug("kept clusters: %d, points to segment: %d", len(kept), len(points_array))
+    if len(points_array) == 0:
+        return kept, []
+
+    with metrics.span("clustering"):
+        if auto_find_clusters_count:
+            # the full search of the clusters count is not repeated for a few digits,
+            # they are counted as separate blobs of ink
+            _, nclusters = ConnectedComponentsEngine(DIGIT_GAP).find_labels(points_array, True, clusters_count)
+            nclusters = min(nclusters, max(clusters_count - len(kept), 1))
+        else:
+            nclusters = clusters_count - len(kept)
+        rs = engine.find_labels(points_array, False, nclusters)
+        if rs is None:
+            return None
+        clusters = points_array.set_labels(*rs)
+    metrics.count("clusters", len(clusters))
+    return kept, clusters
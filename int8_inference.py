@@ -0,0 +1,89 @@
+# full-integer int8 inference with TensorFlow Lite: the Keras model is converted once by post-training quantization
+# (the ranges of activations are calibrated on training images), then weights and activations are int8
+# and the TFLite kernels accumulate products in int32. The interpreter is taken from the LiteRT package
+# (ai_edge_litert) if it is installed, otherwise from TensorFlow
+import os
+import threading
+import numpy as np
+from numpy_inference import ACTIVATIONS
+
+
+def get_interpreter_class():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def convert_model(model, file_path: str, calibration_inputs: np.ndarray):
+    # writes the int8 TFLite model of a Keras model to file_path. The sigmoid of the output layer is left out
+    # of the converted model: most outputs are saturated at 1.0 and int8 cannot tell them apart,
+    # so Int8Model applies it to the dequantized logits
+    import keras
+    import tensorflow as tf
+
+    if model.layers[-1].get_config().get("activation") != "sigmoid":
+        raise Exception("Only models with a sigmoid output layer are supported!")
+    logits_model = keras.models.clone_model(model)
+    logits_model.set_weights(model.get_weights())
+    logits_model.layers[-1].activation = keras.activations.linear
+
+    def representative_dataset():
+        for i in range(len(calibration_inputs)):
+            yield [np.asarray(calibration_inputs[i:i+1], dtype=np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(logits_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    data = converter.convert()
+
+    # the file is replaced at once, so processes loading the model meanwhile never see a half-written one;
+    # every writer has its own temporary file
+    temp_path = "%s.%d.%d.tmp" % (file_path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Int8Model(object):
+    # inference of a model made by convert_model(): the inputs are quantized to int8, the logits are dequantized
+    # and passed through the sigmoid. The interpreter is not thread-safe, batches are predicted one at a time
+    def __init__(self, file_path: str):
+        self.__interpreter = get_interpreter_class()(model_path=file_path, num_threads=os.cpu_count())
+        self.__input = self.__interpreter.get_input_details()[0]
+        self.__output = self.__interpreter.get_output_details()[0]
+        self.__batch_size = None
+        self.__lock = threading.Lock()
+
+    def predict(self, inputs: np.ndarray, batch_size: int = 256):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if inputs.ndim == 4 and inputs.shape[-1] == 1:
+            inputs = inputs[..., 0]
+        with self.__lock:
+            results = [self.__forward(inputs[i:i+batch_size]) for i in range(0, len(inputs), batch_size)]
+        return np.concatenate(results) if len(results) > 0 else np.empty((0, 10), dtype=np.float32)
+
+    def __forward(self, x: np.ndarray):
+        # the tensors are allocated again only when the batch size changes
+        if len(x) != self.__batch_size:
+            self.__interpreter.resize_tensor_input(self.__input["index"], (len(x),) + x.shape[1:])
+            self.__interpreter.allocate_tensors()
+            self.__batch_size = len(x)
+        scale, zero_point = self.__input["quantization"]
+        x = np.clip(np.rint(x / np.float32(scale)) + zero_point, -128, 127).astype(np.int8)
+        self.__interpreter.set_tensor(self.__input["index"], x)
+        self.__interpreter.invoke()
+        scale, zero_point = self.__output["quantization"]
+        logits = (self.__interpreter.get_tensor(self.__output["index"]).astype(np.float32) - zero_point) * \
+            np.float32(scale)
+        return ACTIVATIONS["sigmoid"](logits)
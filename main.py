@@ -1,13 +1,33 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
+import logging
+import os
 import sys
 import numpy as np
 from functools import partial
+import metrics
 from painter import ScenePainter, ScenePainterMode
-from cluster import Clusterizator
-from numbers_recognition import NumbersRecognizer
-import image_converter
+from workers import WarmUpThread, RecognitionWorker
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import QIcon
-from PyQt6.QtCore import QSize
+from PyQt6.QtCore import QSize, QTimer
+
+# heavy modules (cluster, image_converter, numbers_recognition) are imported on demand,
+# they are loaded in background by WarmUpThread right after the start
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
+
+logger = logging.getLogger(__name__)
+
+# names of the pipeline stages (metrics spans) shown after recognition
+STAGE_NAMES = {
+    "extraction": "извлечение точек",
+    "clustering": "кластеризация",
+    "k_search": "поиск числа кластеров",
+    "kmeans_fit": "k-means",
+    "conversion": "преобразование",
+    "inference": "распознавание",
+}
 
 
 class Application(object):
@@ -58,11 +78,35 @@ class Application(object):
         self.__left_panel = QWidget()
         self.__left_panel.setLayout(QVBoxLayout())
         self.__button_recognize = QPushButton()
-        self.__button_recognize.setText("Распознать")
+        self.__button_recognize.setText("Загрузка...")
+        self.__button_recognize.setEnabled(False)
         self.__button_recognize.clicked.connect(self.__button_recognize_clicked)
         self.__left_panel.layout().addWidget(self.__button_recognize)
-
-        self.__left_panel.layout().addWidget(QLabel("Количество кластеров:"))
+        self.__button_cancel = QPushButton()
+        self.__button_cancel.setText("Отмена")
+        self.__button_cancel.setVisible(False)
+        self.__button_cancel.clicked.connect(self.__button_cancel_clicked)
+        self.__left_panel.layout().addWidget(self.__button_cancel)
+
+        self.__left_panel.layout().addWidget(QLabel("Метод сегментации:"))
+        self.__combobox_engine = QComboBox()
+        self.__combobox_engine.addItems(["K-means", "K-means, быстрый поиск", "Связные компоненты"])
+        self.__combobox_engine.currentIndexChanged.connect(self.__combobox_engine_changed)
+        self.__left_panel.layout().addWidget(self.__combobox_engine)
+        self.__spinbox_dilation = QSpinBox()
+        self.__spinbox_dilation.setMaximum(50)
+        self.__spinbox_dilation.setValue(5)
+        self.__dilation = QWidget()
+        self.__dilation.setLayout(QHBoxLayout())
+        self.__dilation.layout().setSpacing(0)
+        self.__dilation.layout().setContentsMargins(0, 0, 0, 0)
+        self.__dilation.layout().addWidget(QLabel("Расширение, пикс.:"))
+        self.__dilation.layout().addWidget(self.__spinbox_dilation)
+        self.__left_panel.layout().addWidget(self.__dilation)
+        self.__dilation.setVisible(False)
+
+        self.__label_clusters_count = QLabel("Количество кластеров:")
+        self.__left_panel.layout().addWidget(self.__label_clusters_count)
         self.__checkbox_auto_clusters = QCheckBox("авто")
         self.__checkbox_auto_clusters.setChecked(True)
         self.__checkbox_auto_clusters.clicked.connect(self.__checkbox_auto_clusters_clicked)
@@ -95,6 +139,9 @@ class Application(object):
 
         self.__label_result = QLabel()
         self.__left_panel.layout().addWidget(self.__label_result)
+        self.__label_stages = QLabel()
+        self.__label_stages.setWordWrap(True)
+        self.__left_panel.layout().addWidget(self.__label_stages)
 
         self.__progress_bar = QProgressBar()
         self.__progress_bar.setMaximum(200)
@@ -121,6 +168,19 @@ class Application(object):
         #
         self.__show_result_buttons = []
 
+        self.__measure_startup = "--startup-time" in argv
+        self.__warm_up_thread = WarmUpThread()
+        self.__warm_up_thread.ready.connect(self.__warm_up_ready)
+        self.__warm_up_thread.failed.connect(self.__warm_up_failed)
+
+        # the current recognition run, a new run supersedes (cancels) the previous one,
+        # workers are kept until their threads finish
+        self.__recognition_worker = None
+        self.__running_workers = []
+        self.__clusters = []
+        # the result of the last finished run, the next run with the same settings recognizes only the changes
+        self.__last_result = None
+
     def __painter_toolbutton_modepaint_clicked(self):
         self.__painter_toolbutton_modepaint.setChecked(True)
         self.__painter_toolbutton_modeerase.setChecked(False)
@@ -132,67 +192,134 @@ class Application(object):
         self.__painter.setmode(ScenePainterMode.ERASE)
 
     def __painter_toolbutton_clear_clicked(self):
+        self.__cancel_recognition()
         self.__painter.clear()
+        self.__last_result = None
         self.__remove_result_components()
 
     def __remove_result_components(self):
         self.__label_result.setText("")
+        self.__label_stages.setText("")
         self.__show_result_buttons = []
         for i in reversed(range(self.__result_widget.layout().count())):
             self.__result_widget.layout().itemAt(i).widget().setParent(None)
 
-    def __enable_components(self, enabled: bool):
-        self.__button_recognize.setEnabled(enabled)
-        self.__painter_toolbutton_clear.setEnabled(enabled)
-        self.__painter_toolbutton_modepaint.setEnabled(enabled)
-        self.__painter_toolbutton_modeerase.setEnabled(enabled)
-        self.__checkbox_auto_clusters.setEnabled(enabled)
-        self.__max_clusters.setEnabled(enabled)
-        self.__fixed_clusters.setEnabled(enabled)
-        self.__main_window.update()
-        self.__app.processEvents()
+    def __warm_up_ready(self, warm_up_time: float):
+        self.__button_recognize.setText("Распознать")
+        self.__button_recognize.setEnabled(True)
+        if self.__measure_startup:
+            print("warm-up time: %.3f s, ready at: %.3f s" % (warm_up_time, time.perf_counter() - STARTUP_TIME))
+            self.__app.quit()
+
+    def __warm_up_failed(self, message: str):
+        # the error stays visible, and the button is enabled: a recognition run loads the model again,
+        # so the first click retries the loading (and shows the error again if it fails)
+        self.__button_recognize.setText("Распознать")
+        self.__button_recognize.setEnabled(True)
+        self.__label_result.setText("Ошибка загрузки: " + message)
+        if self.__measure_startup:
+            self.__app.quit()
+
+    def __first_window_shown(self):
+        print("import time: %.3f s, time to first window: %.3f s" % (IMPORT_TIME,
+                                                                     time.perf_counter() - STARTUP_TIME))
 
     def __checkbox_auto_clusters_clicked(self):
         self.__max_clusters.setVisible(self.__checkbox_auto_clusters.isChecked())
         self.__fixed_clusters.setVisible(not self.__max_clusters.isVisible())
 
-    def __progress_callback(self, progress: int):
-        self.__progress_bar.setValue(progress)
-        self.__app.processEvents()
+    def __combobox_engine_changed(self):
+        kmeans = self.__combobox_engine.currentIndex() != 2
+        self.__dilation.setVisible(not kmeans)
+        self.__label_clusters_count.setVisible(kmeans)
+        self.__checkbox_auto_clusters.setVisible(kmeans)
+        self.__max_clusters.setVisible(kmeans and self.__checkbox_auto_clusters.isChecked())
+        self.__fixed_clusters.setVisible(kmeans and not self.__checkbox_auto_clusters.isChecked())
+
+    def __create_engine(self):
+        from cluster import KMeansEngine, ConnectedComponentsEngine, SweepMode
+        if self.__combobox_engine.currentIndex() == 0:
+            return KMeansEngine(workers=os.cpu_count() or 1)
+        if self.__combobox_engine.currentIndex() == 1:
+            return KMeansEngine(mode=SweepMode.INCREMENTAL)
+        return ConnectedComponentsEngine(self.__spinbox_dilation.value())
 
     def __button_recognize_clicked(self):
+        self.__cancel_recognition()
         self.__remove_result_components()
-        self.__enable_components(False)
         self.__label_result.setText("Кластеризация...")
 
         self.__progress_bar.setValue(0)
         self.__progress_bar.setVisible(True)
-        self.__app.processEvents()
+        self.__button_cancel.setVisible(True)
 
-        clusterizator = Clusterizator(self.__painter.getpixmap())
-        clusterizator.set_progress_callback(self.__progress_callback)
         auto_clusters = self.__checkbox_auto_clusters.isChecked()
         clusters_count = self.__spinbox_max_clusters.value() if auto_clusters else self.__spinbox_fixed_clusters.value()
-        print("clusters_count:", clusters_count)
-        self.__clusters = clusterizator.clusterize(auto_clusters, clusters_count)
-        cluster_count = len(self.__clusters)
+        engine_index = self.__combobox_engine.currentIndex()
+        settings = (engine_index, self.__spinbox_dilation.value() if engine_index == 2 else None, auto_clusters,
+                    clusters_count)
+        previous = self.__last_result
+        if previous is not None and previous.settings != settings:
+            previous = None
+        # the worker gets a snapshot of the strokes, there is no need to render the scene
+        worker = RecognitionWorker(self.__painter.get_strokes(), self.__create_engine(),
+                                   auto_clusters, clusters_count, previous, settings)
+        worker.progress.connect(partial(self.__recognition_progress, worker))
+        worker.clustered.connect(partial(self.__recognition_clustered, worker))
+        worker.recognized.connect(partial(self.__recognition_finished, worker))
+        worker.cancelled.connect(partial(self.__recognition_stopped, worker, "Отменено"))
+        worker.failed.connect(partial(self.__recognition_failed, worker))
+        worker.finished.connect(partial(self.__recognition_thread_finished, worker))
+        self.__recognition_worker = worker
+        self.__running_workers.append(worker)
+        worker.start()
+
+    def __button_cancel_clicked(self):
+        self.__cancel_recognition()
+
+    def __cancel_recognition(self):
+        if self.__recognition_worker is None:
+            return
+        self.__recognition_worker.cancel()
+        self.__recognition_stopped(self.__recognition_worker, "Отменено")
 
-        self.__label_result.setText("Распознавание...")
-        self.__app.processEvents()
-        numbers_recognizer = NumbersRecognizer()
+    def __recognition_thread_finished(self, worker: RecognitionWorker):
+        self.__running_workers.remove(worker)
 
-        self.__cluster_predictions = []
-        self.__cluster_images = []
-        for i in range(cluster_count):
-            converter = image_converter.ImageConverter(self.__clusters[i])
-            self.__cluster_predictions.append(numbers_recognizer.do_predict(converter.get_data()))
-            self.__cluster_images.append(converter.get_image())
-            self.__progress_callback(int(100 + i/cluster_count*100))
+    def __recognition_progress(self, worker: RecognitionWorker, progress: int):
+        if worker is self.__recognition_worker:
+            self.__progress_bar.setValue(progress)
+
+    def __recognition_clustered(self, worker: RecognitionWorker, clusters: list):
+        if worker is self.__recognition_worker:
+            self.__label_result.setText("Найдено кластеров: " + str(len(clusters)) + ", распознавание...")
+
+    def __recognition_failed(self, worker: RecognitionWorker, message: str):
+        self.__recognition_stopped(worker, "Ошибка: " + message)
+
+    def __recognition_stopped(self, worker: RecognitionWorker, message: str):
+        if worker is not self.__recognition_worker:
+            return
+        self.__recognition_worker = None
+        self.__label_result.setText(message)
+        self.__progress_bar.setVisible(False)
+        self.__button_cancel.setVisible(False)
+
+    def __recognition_finished(self, worker: RecognitionWorker, clusters: list, images: list, predictions):
+        if worker is not self.__recognition_worker:
+            return
+        self.__recognition_worker = None
+        self.__last_result = worker.get_result()
+        self.__clusters = clusters
+        self.__cluster_images = images
+        self.__cluster_predictions = predictions
+        cluster_count = len(self.__clusters)
 
         self.__label_result.setText("Найдено кластеров: " + str(cluster_count))
+        self.__show_stages(worker.get_recorder())
 
-        self.__enable_components(True)
         self.__progress_bar.setVisible(False)
+        self.__button_cancel.setVisible(False)
 
         if cluster_count == 0:
             return
@@ -218,11 +345,22 @@ class Application(object):
             widget.layout().addWidget(button)
             self.__result_widget.layout().addWidget(widget)
 
+    def __show_stages(self, recorder: metrics.Recorder):
+        # the time of every stage of the last run, nested stages are included in the outer ones
+        lines = ["%s: %d мс" % (STAGE_NAMES.get(name, name), duration * 1000)
+                 for name, duration in recorder.get_durations().items()]
+        counters = recorder.get_counters()
+        if counters.get("cache_hits", 0) > 0:
+            lines.append("из кэша: %d" % counters["cache_hits"])
+        self.__label_stages.setText("\n".join(lines))
+
     def show_cluster(self, index):
+        from image_converter import save_image
+
         self.__painter.highlight_points(self.__clusters[index])
-        self.__cluster_images[index].save("number.png")
-        print("Prediction:", self.__cluster_predictions[index])
-        print("Prediction argmax:", np.argmax(self.__cluster_predictions[index]))
+        save_image("number.png", self.__cluster_images[index])
+        logger.debug("Prediction: %s", self.__cluster_predictions[index])
+        logger.debug("Prediction argmax: %d", np.argmax(self.__cluster_predictions[index]))
         self.__show_result_buttons[index].setIcon(QIcon("icons/light-bulb.png"))
         for i in range(len(self.__show_result_buttons)):
             if i == index:
@@ -232,9 +370,22 @@ class Application(object):
 
     def run(self):
         self.__main_window.show()
+        if self.__measure_startup:
+            QTimer.singleShot(0, self.__first_window_shown)
+        self.__warm_up_thread.start()
         self.__app.exec()
+        self.__cancel_recognition()
+        for worker in list(self.__running_workers):
+            worker.wait()
+        self.__warm_up_thread.wait()
 
 
 if __name__ == '__main__':
+    # --debug enables verbose dumps of the pipeline, --metrics-file=<path> appends metrics of every run to the file
+    logging.basicConfig(level=logging.DEBUG if "--debug" in sys.argv else logging.WARNING,
+                        format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    for arg in sys.argv:
+        if arg.startswith("--metrics-file="):
+            metrics.set_sink(metrics.JsonLinesSink(arg[len("--metrics-file="):]))
     app = Application(sys.argv, "Numbers recognizer v0.0.1")
     app.run()
@@ -0,0 +1,147 @@
+# instrumentation of the recognition pipeline: named timing spans and counters of one run are collected
+# by a Recorder and sent to a sink when the run is finished.
+# The code being measured does not know about runs, it uses the module functions span() and count(),
+# which record to the recorder of the current thread (and do nothing if there is no recorder)
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class NullSink(object):
+    def emit(self, record: dict):
+        pass
+
+
+class LogSink(object):
+    # every finished run is logged as a single line of JSON
+    def __init__(self, level: int = logging.INFO):
+        self.__level = level
+
+    def emit(self, record: dict):
+        logger.log(self.__level, "%s", json.dumps(record))
+
+
+class JsonLinesSink(object):
+    # every finished run is appended to the file as a line of JSON
+    def __init__(self, file_path: str):
+        self.__file_path = file_path
+        self.__lock = threading.Lock()
+
+    def emit(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self.__lock:
+            with open(self.__file_path, "a") as file:
+                file.write(line)
+
+
+class MemorySink(object):
+    # keeps all records, for tests and benchmarks
+    def __init__(self):
+        self.records = []
+        self.__lock = threading.Lock()
+
+    def emit(self, record: dict):
+        with self.__lock:
+            self.records.append(record)
+
+
+class Recorder(object):
+    def __init__(self, name: str, sink=None):
+        self.__name = name
+        self.__sink = sink
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+        # [(name, start offset, duration)] in the order of finishing, the same name may be recorded several times
+        self.__spans = []
+        self.__counters = {}
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.__lock:
+                self.__spans.append((name, start - self.__start, end - start))
+
+    def count(self, name: str, value=1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def get_spans(self):
+        with self.__lock:
+            return list(self.__spans)
+
+    def get_counters(self):
+        with self.__lock:
+            return dict(self.__counters)
+
+    def get_durations(self):
+        # {span name: total duration}, in the order of the first start of a span
+        durations = {}
+        for name, start, duration in sorted(self.get_spans(), key=lambda s: s[1]):
+            durations[name] = durations.get(name, 0.0) + duration
+        return durations
+
+    def to_record(self):
+        return {
+            "run": self.__name,
+            "time": time.time(),
+            "total": time.perf_counter() - self.__start,
+            "spans": [{"name": name, "start": start, "duration": duration}
+                      for name, start, duration in self.get_spans()],
+            "counters": self.get_counters(),
+        }
+
+    def finish(self):
+        sink = self.__sink if self.__sink is not None else get_sink()
+        sink.emit(self.to_record())
+
+
+_sink = NullSink()
+_local = threading.local()
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink if sink is not None else NullSink()
+
+
+def get_sink():
+    return _sink
+
+
+def get_recorder():
+    return getattr(_local, "recorder", None)
+
+
+@contextmanager
+def recording(recorder: Recorder):
+    # makes the recorder current for the calling thread
+    previous = get_recorder()
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+@contextmanager
+def span(name: str):
+    recorder = get_recorder()
+    if recorder is None:
+        yield
+        return
+    with recorder.span(name):
+        yield
+
+
+def count(name: str, value=1):
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.count(name, value)
@@ -1,67 +1,173 @@
-import tensorflow as tf
-import keras
-import keras.utils
-from keras.layers import Dense, Flatten
-from keras.models import Sequential
-from keras.datasets import mnist
+from enum import Enum
+from numpy_inference import NumpyModel, export_weights
 import numpy as np
 import os
+import threading
+
+MODEL_FILE_PATH = "data/trained_model"
+NUMPY_WEIGHTS_FILE_PATH = "data/trained_model.npz"
+INT8_MODEL_FILE_PATH = "data/trained_model_int8.tflite"
+# training images the ranges of int8 activations are calibrated on
+INT8_CALIBRATION_SIZE = 500
+
+
+class RecognizerBackend(Enum):
+    # KERAS - the trained Keras model, TensorFlow is imported only for this backend (and for training)
+    # NUMPY - the weights exported from the Keras model (see numpy_inference.py), inference with NumPy only
+    # INT8 - the model converted to a full-integer int8 TensorFlow Lite model (see int8_inference.py): several times
+    #        faster than NUMPY and 4 times smaller, needs TensorFlow Lite (LiteRT or TensorFlow)
+    KERAS = 1
+    NUMPY = 2
+    INT8 = 3
+
+
+def ensure_dataset():
+    # MNIST is downloaded once and stored as .npy files
+    if not os.path.exists("data/xtrain.npy"):
+        from keras.datasets import mnist
+        os.makedirs("./data", exist_ok=True)
+        (X_train, y_train), (X_test, y_test) = mnist.load_data()
+        np.save("data/xtrain", X_train)
+        np.save("data/ytrain", y_train)
+        np.save("data/xtest", X_test)
+        np.save("data/ytest", y_test)
+
+
+def load_normalized(name: str):
+    # the data normalized to [0.0, 1.0] is stored as float32 next to the original one once,
+    # later it is just memory-mapped
+    file_path = "data/" + name + "_float32.npy"
+    if not os.path.exists(file_path):
+        source = np.load("data/" + name + ".npy", mmap_mode="r")
+        target = np.lib.format.open_memmap(file_path + ".tmp", mode="w+", dtype=np.float32, shape=source.shape)
+        chunk_size = 10000
+        for i in range(0, len(source), chunk_size):
+            target[i:i+chunk_size] = source[i:i+chunk_size] / np.float32(255)
+        target.flush()
+        del target
+        os.replace(file_path + ".tmp", file_path)
+    return np.load(file_path, mmap_mode="r")
+
+
+def load_categorical(name: str):
+    # categorize labels (turn an array [1,0,9,...] into
+    #                    [[0,1,0,0,0,0,0,0,0,0],[1,0,0,0,0,0,0,0,0,0],[0,0,0,0,0,0,0,0,0,1],...])
+    return np.eye(10, dtype=np.float32)[np.load("data/" + name + ".npy")]
+
+
+def get_calibration_inputs(inputs: np.ndarray):
+    # a random (but always the same) part of the normalized training images for the int8 conversion
+    indices = np.random.default_rng(0).choice(len(inputs), min(INT8_CALIBRATION_SIZE, len(inputs)), replace=False)
+    return np.asarray(inputs[np.sort(indices)], dtype=np.float32)
+
+
+def build_model(input_shape: tuple = (28, 28)):
+    # see https://habr.com/ru/post/705306/
+    # the untrained model: Dense layers are applied to the last axis of the input, so every row of an image
+    # is transformed separately before the rows are flattened for the output layer
+    from keras.layers import Dense, Flatten
+    from keras.models import Sequential
+
+    model = Sequential()
+    model.add(Dense(32, activation='relu', input_shape=input_shape))
+    model.add(Dense(64, activation='relu'))
+    model.add(Dense(128, activation='relu'))
+    model.add(Dense(256, activation='relu'))
+    model.add(Dense(512, activation='relu'))
+    model.add(Flatten())
+    model.add(Dense(10, activation='sigmoid'))
+    model.compile(loss='categorical_crossentropy',
+                  optimizer='adam',
+                  metrics=['accuracy'])
+    return model
 
 
 class NumbersRecognizer(object):
-    def __init__(self):
+    # loading of the model is expensive, so a single recognizer should be created once per process and reused,
+    # see get_instance(). The dataset is not needed for inference, it is loaded only for training and evaluation
+    __instances = {}
+    __instances_lock = threading.Lock()
+
+    def __init__(self, backend: RecognizerBackend = RecognizerBackend.KERAS):
         os.makedirs("./data", exist_ok=True)
-        if os.path.exists("data/xtrain.npy"):
-            self.__X_train = np.load("data/xtrain.npy")
-            self.__y_train = np.load("data/ytrain.npy")
-            self.__X_test = np.load("data/xtest.npy")
-            self.__y_test = np.load("data/ytest.npy")
+        self.__backend = backend
+        self.__X_train, self.__y_train = None, None
+        self.__X_test, self.__y_test = None, None
+        if backend == RecognizerBackend.NUMPY:
+            self.__model = NumpyModel(NUMPY_WEIGHTS_FILE_PATH)
+        elif backend == RecognizerBackend.INT8:
+            from int8_inference import Int8Model
+            # the int8 model is converted from the Keras one once
+            if not os.path.exists(INT8_MODEL_FILE_PATH):
+                NumbersRecognizer(RecognizerBackend.KERAS).export_int8_model(INT8_MODEL_FILE_PATH)
+            self.__model = Int8Model(INT8_MODEL_FILE_PATH)
         else:
-            (self.__X_train, self.__y_train), (self.__X_test, self.__y_test) = mnist.load_data()
-            np.save("data/xtrain", self.__X_train)
-            np.save("data/ytrain", self.__y_train)
-            np.save("data/xtest", self.__X_test)
-            np.save("data/ytest", self.__y_test)
+            self.__model = self.__get_model()
+
+    @staticmethod
+    def get_instance(backend: RecognizerBackend = RecognizerBackend.KERAS):
+        with NumbersRecognizer.__instances_lock:
+            if backend not in NumbersRecognizer.__instances:
+                NumbersRecognizer.__instances[backend] = NumbersRecognizer(backend)
+            return NumbersRecognizer.__instances[backend]
+
+    @staticmethod
+    def get_default_backend():
+        # the NumPy backend is preferred if the weights have been exported
+        return RecognizerBackend.NUMPY if os.path.exists(NUMPY_WEIGHTS_FILE_PATH) else RecognizerBackend.KERAS
+
+    def get_backend(self):
+        return self.__backend
 
-        # normalize input data
-        self.__X_train = self.__X_train / 255
-        self.__X_test = self.__X_test / 255
+    def load_dataset(self):
+        if self.__X_train is not None:
+            return
+        ensure_dataset()
+        # normalized input data is memory-mapped, not loaded
+        self.__X_train = load_normalized("xtrain")
+        self.__X_test = load_normalized("xtest")
+        self.__y_train = load_categorical("ytrain")
+        self.__y_test = load_categorical("ytest")
 
-        # categorize labels (turn an array [1,0,9,...] into
-        #                    [[0,1,0,0,0,0,0,0,0,0],[1,0,0,0,0,0,0,0,0,0],[0,0,0,0,0,0,0,0,0,1],...])
-        self.__y_train = keras.utils.to_categorical(self.__y_train, 10)
-        self.__y_test = keras.utils.to_categorical(self.__y_test, 10)
+    def get_test_data(self):
+        self.load_dataset()
+        return self.__X_test, self.__y_test
 
-        self.__model = self.__get_model()
+    def evaluate(self):
+        self.load_dataset()
+        predictions = self.predict_batch(self.__X_test)
+        accuracy = float((predictions.argmax(axis=1) == self.__y_test.argmax(axis=1)).mean())
+        print("Model accuracy:", accuracy)
+        return accuracy
 
-        print("Model accuracy:")
-        self.__model.evaluate(self.__X_test, self.__y_test)
+    def export_numpy_weights(self, file_path: str = NUMPY_WEIGHTS_FILE_PATH):
+        export_weights(self.__model, file_path)
+
+    def export_int8_model(self, file_path: str = INT8_MODEL_FILE_PATH):
+        from int8_inference import convert_model
+        self.load_dataset()
+        convert_model(self.__model, file_path, get_calibration_inputs(self.__X_train))
 
     def __get_model(self):
-        # see https://habr.com/ru/post/705306/
-
-        model_file_path = "data/trained_model"
-
-        if os.path.exists(model_file_path):
-            model = keras.models.load_model(model_file_path)
-            return model
-
-        # there is no pretrained model, create and train a new one:
-        model = Sequential()
-        model.add(Dense(32, activation='relu', input_shape=self.__X_train[0].shape))
-        model.add(Dense(64, activation='relu'))
-        model.add(Dense(128, activation='relu'))
-        model.add(Dense(256, activation='relu'))
-        model.add(Dense(512, activation='relu'))
-        model.add(Flatten())
-        model.add(Dense(10, activation='sigmoid'))
-        model.compile(loss='categorical_crossentropy',
-                      optimizer='adam',
-                      metrics=['accuracy'])
-        model.fit(self.__X_train, self.__y_train, epochs=100)
-        model.save(model_file_path)
-
-        return model
+        import keras
+
+        if os.path.exists(MODEL_FILE_PATH):
+            return keras.models.load_model(MODEL_FILE_PATH)
+
+        # there is no pretrained model, train a new one (see train.py)
+        from train import train_model
+        return train_model()[0]
 
     def do_predict(self, input):
-        return self.__model.predict(input)
\ No newline at end of file
+        return self.__model.predict(input)
+
+    def predict_batch(self, inputs: np.ndarray, batch_size: int = 256):
+        # inputs is a stack of (n, 28, 28, 1) images, they are all predicted by a single call,
+        # so the per-call overhead of the model is paid once; returns (n, 10) probabilities
+        if len(inputs) == 0:
+            return np.empty((0, 10), dtype=np.float32)
+        return self.__model.predict(inputs, batch_size=min(len(inputs), batch_size))
+
+
+if __name__ == '__main__':
+    NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend()).evaluate()
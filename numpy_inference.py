@@ -0,0 +1,79 @@
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    # the clipping prevents overflows of exp(), sigmoid is 0.0 or 1.0 there anyway
+    "sigmoid": lambda x: 1 / (1 + np.exp(-np.clip(x, -88, 88))),
+}
+
+
+def export_weights(model, file_path: str):
+    # writes weights of a Sequential model consisting of Dense and Flatten layers to a .npz file,
+    # layers are described by strings "dense:<activation>" and "flatten"
+    layers = []
+    arrays = {}
+    for layer in model.layers:
+        class_name = layer.__class__.__name__
+        if class_name == "Dense":
+            kernel, bias = layer.get_weights()
+            arrays["kernel_" + str(len(layers))] = kernel.astype(np.float32)
+            arrays["bias_" + str(len(layers))] = bias.astype(np.float32)
+            layers.append("dense:" + layer.get_config()["activation"])
+        elif class_name == "Flatten":
+            layers.append("flatten")
+        else:
+            raise Exception("Layer " + class_name + " is not supported!")
+    np.savez(file_path, layers=np.array(layers), **arrays)
+
+
+class NumpyModel(object):
+    # forward pass of the exported model implemented with NumPy only, so neither TensorFlow nor Keras
+    # are needed for inference. As in Keras, a Dense layer is applied to the last axis of its input
+    def __init__(self, file_path: str):
+        with np.load(file_path) as data:
+            self.__layers = []
+            for i, layer in enumerate(data["layers"].tolist()):
+                if layer == "flatten":
+                    self.__layers.append((layer, None, None, None))
+                else:
+                    activation = layer.split(":")[1]
+                    if activation not in ACTIVATIONS:
+                        raise Exception("Activation " + activation + " is not supported!")
+                    self.__layers.append(("dense", data["kernel_" + str(i)], data["bias_" + str(i)],
+                                          ACTIVATIONS[activation]))
+
+    def predict(self, inputs: np.ndarray, batch_size: int = 256):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        # images of shape (28, 28, 1) are treated as (28, 28) like Keras does for the model input (None, 28, 28)
+        if inputs.ndim == 4 and inputs.shape[-1] == 1:
+            inputs = inputs[..., 0]
+        results = [self.__forward(inputs[i:i+batch_size]) for i in range(0, len(inputs), batch_size)]
+        return np.concatenate(results) if len(results) > 0 else np.empty((0, 10), dtype=np.float32)
+
+    def __forward(self, x: np.ndarray):
+        for layer, kernel, bias, activation in self.__layers:
+            if layer == "flatten":
+                x = x.reshape(len(x), -1)
+            else:
+                x = activation(x @ kernel + bias)
+        return x
+
+
+if __name__ == '__main__':
+    # export the trained Keras model and check that the NumPy forward pass gives the same results,
+    # then convert the model to int8 (see int8_inference.py)
+    from numbers_recognition import NumbersRecognizer, RecognizerBackend, NUMPY_WEIGHTS_FILE_PATH, \
+        INT8_MODEL_FILE_PATH
+    keras_recognizer = NumbersRecognizer(RecognizerBackend.KERAS)
+    keras_recognizer.export_numpy_weights(NUMPY_WEIGHTS_FILE_PATH)
+    numpy_recognizer = NumbersRecognizer(RecognizerBackend.NUMPY)
+    keras_recognizer.load_dataset()
+    test_inputs = keras_recognizer.get_test_data()[0][:1000]
+    difference = np.abs(keras_recognizer.predict_batch(test_inputs) - numpy_recognizer.predict_batch(test_inputs))
+    print("Weights are exported to", NUMPY_WEIGHTS_FILE_PATH + ", max difference with Keras:", difference.max())
+    keras_recognizer.export_int8_model(INT8_MODEL_FILE_PATH)
+    int8_recognizer = NumbersRecognizer(RecognizerBackend.INT8)
+    agreement = (int8_recognizer.predict_batch(test_inputs).argmax(axis=1) ==
+                 numpy_recognizer.predict_batch(test_inputs).argmax(axis=1)).mean()
+    print("The model is converted to", INT8_MODEL_FILE_PATH + ", same digits as float32:", agreement)
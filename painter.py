@@ -1,6 +1,16 @@
 from enum import Enum
-from PyQt6.QtWidgets import QGraphicsScene, QGraphicsView
-from PyQt6.QtGui import QPen, QBrush, QMouseEvent, QResizeEvent, QPixmap, QPainter, QColor
+import logging
+import weakref
+import numpy as np
+from PyQt6.QtWidgets import QGraphicsScene, QGraphicsView, QGraphicsItem
+from PyQt6.QtGui import QPen, QBrush, QMouseEvent, QResizeEvent, QPixmap, QPainter, QColor, QImage, QPainterPath
+from PyQt6.QtCore import QRectF, QLineF
+from typing import TYPE_CHECKING
+from strokes import StrokeModel, StrokeKind
+if TYPE_CHECKING:
+    from cluster import Cluster
+
+logger = logging.getLogger(__name__)
 
 
 class ScenePainterMode(Enum):
@@ -8,6 +18,29 @@ class ScenePainterMode(Enum):
     ERASE = 2
 
 
+class CanvasMode(Enum):
+    # ITEMS - every line and every eraser square is a separate item of the scene
+    # RASTER - finished strokes are painted into a single image item, only the stroke being drawn is a separate
+    #          item, so the count of items and the cost of redrawing do not grow with the drawing
+    ITEMS = 1
+    RASTER = 2
+
+
+class CanvasItem(QGraphicsItem):
+    # shows an image, only the exposed part of the image is drawn
+    def __init__(self, image: QImage):
+        super().__init__()
+        self.__image = image
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(self.__image.rect())
+
+    def paint(self, painter: QPainter, option, widget=None) -> None:
+        rect = option.exposedRect
+        painter.drawImage(rect, self.__image, rect)
+
+
 class MouseIndicator(object):
     def paint(self, x: int, y: int, scene: QGraphicsScene):
         self.hide(scene)
@@ -51,9 +84,26 @@ class MouseIndicatorErase(MouseIndicator):
         self.__rect = None
 
 
+def get_highlight_image(points: "Cluster"):
+    # red squares of 3x3 pixels around the points (what a 2x2 rectangle outline covers) on a transparent image,
+    # the image is placed at (min_x - 1, min_y - 1)
+    width = points.max_x - points.min_x + 3
+    height = points.max_y - points.min_y + 3
+    xs = points.xs - points.min_x
+    ys = points.ys - points.min_y
+    mask = np.zeros((height, width), dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            mask[ys + dy, xs + dx] = True
+    colors = np.zeros((height, width), dtype=np.uint32)
+    colors[mask] = 0xFFFF0000
+    return QImage(colors.data, width, height, width * 4, QImage.Format.Format_ARGB32).copy()
+
+
 class ScenePainter(QGraphicsView):
-    def __init__(self):
+    def __init__(self, canvas_mode: CanvasMode = CanvasMode.RASTER):
         super().__init__()
+        self.__canvas_mode = canvas_mode
         self.__scene = QGraphicsScene(0, 0, 1024, 768)
         self.setScene(self.__scene)
 
@@ -61,13 +111,26 @@ class ScenePainter(QGraphicsView):
         self.__mouse_pressed = False
 
         self.__mouse_indicator = MouseIndicatorPaint()
+        self.__pen_width = 2
         self.__eraser_size = 20
+        # everything drawn is kept as strokes as well, the recognition uses them instead of the rendered scene
+        self.__strokes = StrokeModel(int(self.__scene.width()), int(self.__scene.height()))
+        self.__stroke = None
 
         self.__mode: ScenePainterMode = ScenePainterMode.PAINT
         self.__mouseX, self.__mouseY = None, None
         self.__bg = None
+        # RASTER mode: the image of finished strokes, its item and the item of the stroke being drawn
+        self.__canvas_image = None
+        self.__canvas_item = None
+        self.__live_item = None
+        self.__live_path = None
 
         self.__highlighted_points = []
+        # highlighting of a cluster is a single pixmap item, pixmaps are kept while their clusters exist
+        self.__highlight_cache = weakref.WeakKeyDictionary()
+        if self.__canvas_mode == CanvasMode.RASTER:
+            self.__resize_canvas()
 
     def clear(self):
         self.__mouse_indicator.hide(self.__scene)
@@ -76,9 +139,14 @@ class ScenePainter(QGraphicsView):
             self.__scene.removeItem(self.__bg)
 
         self.__scene.clear()
+        self.__strokes.clear()
 
         self.__mouseX, self.__mouseY = None, None
         self.__bg = None
+        self.__canvas_image = None
+        self.__canvas_item = None
+        self.__live_item = None
+        self.__live_path = None
 
         self.on_resize()
 
@@ -88,10 +156,18 @@ class ScenePainter(QGraphicsView):
                 self.__scene.removeItem(self.__highlighted_points[i])
         self.__highlighted_points = []
 
-    def highlight_points(self, points):
+    def highlight_points(self, points: "Cluster"):
         self.__remove_highlighted_points()
-        for i in range(len(points)):
-            self.__highlighted_points.append(self.__scene.addRect(points[i].x-1, points[i].y-1, 2, 2, QColor("red")))
+        if len(points) == 0:
+            return
+        pixmap = self.__highlight_cache.get(points)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(get_highlight_image(points))
+            self.__highlight_cache[points] = pixmap
+        item = self.__scene.addPixmap(pixmap)
+        item.setPos(points.min_x - 1, points.min_y - 1)
+        item.setZValue(1)
+        self.__highlighted_points.append(item)
 
     def setmode(self, mode: ScenePainterMode):
         self.__mode = mode
@@ -101,18 +177,29 @@ class ScenePainter(QGraphicsView):
         else:
             self.__mouse_indicator = MouseIndicatorErase(self.__eraser_size)
 
+    def get_strokes(self):
+        # a snapshot of the drawing, it may be used in another thread
+        return self.__strokes.snapshot()
+
     def getpixmap(self):
         self.__mouse_indicator.hide(self.__scene)
+        if self.__canvas_mode == CanvasMode.RASTER:
+            self.__finish_live_stroke()
+            return QPixmap.fromImage(self.__canvas_image)
         pixmap = QPixmap(int(self.__scene.width()), int(self.__scene.height()))
         painter = QPainter(pixmap)
         self.__scene.render(painter)
         return pixmap
 
     def on_resize(self):
-        print("on_resize")
+        logger.debug("on_resize")
         if self.__bg is not None:
             self.__scene.removeItem(self.__bg)
         self.__scene.setSceneRect(0, 0, self.width(), self.height())
+        self.__strokes.set_size(int(self.__scene.width()), int(self.__scene.height()))
+        if self.__canvas_mode == CanvasMode.RASTER:
+            self.__resize_canvas()
+            return
         self.__bg = self.__scene.addRect(0, 0,
                                          int(self.__scene.width()),
                                          int(self.__scene.height()),
@@ -120,6 +207,56 @@ class ScenePainter(QGraphicsView):
                                          QBrush(QColor(255, 255, 255, 255)))
         self.__bg.setZValue(-1)
 
+    def __resize_canvas(self):
+        # the canvas image is painted again from the strokes, so strokes outside of the smaller canvas
+        # are not lost and appear again when the canvas grows
+        self.__finish_live_stroke()
+        self.__canvas_image = QImage(int(self.__scene.width()), int(self.__scene.height()),
+                                     QImage.Format.Format_RGB32)
+        self.__canvas_image.fill(QColor(255, 255, 255, 255))
+        painter = QPainter(self.__canvas_image)
+        for stroke in self.__strokes.get_strokes():
+            self.__paint_stroke(painter, stroke.kind, stroke.width, stroke.points)
+        painter.end()
+        if self.__canvas_item is not None:
+            self.__scene.removeItem(self.__canvas_item)
+        self.__canvas_item = CanvasItem(self.__canvas_image)
+        self.__canvas_item.setZValue(-1)
+        self.__scene.addItem(self.__canvas_item)
+
+    @staticmethod
+    def __paint_stroke(painter: QPainter, kind: StrokeKind, width: int, points):
+        # paints a stroke (or a part of it) the same way as it is drawn by scene items
+        if kind == StrokeKind.INK:
+            pen = QPen(QColor(0, 0, 0, 255))
+            pen.setWidth(width)
+            painter.setPen(pen)
+            points = points.tolist()
+            painter.drawLines([QLineF(x0, y0, x1, y1) for (x0, y0), (x1, y1) in zip(points, points[1:])])
+        else:
+            painter.setPen(QPen(QColor(255, 255, 255, 255)))
+            painter.setBrush(QBrush(QColor(255, 255, 255, 255)))
+            for x, y in points.tolist():
+                painter.drawRect(QRectF(x - width / 2, y - width / 2, width, width))
+
+    def __paint_on_canvas(self, kind: StrokeKind, width: int, points):
+        painter = QPainter(self.__canvas_image)
+        self.__paint_stroke(painter, kind, width, points)
+        painter.end()
+        margin = width / 2 + 1
+        min_x, min_y = points.min(axis=0) - margin
+        max_x, max_y = points.max(axis=0) + margin
+        self.__canvas_item.update(QRectF(min_x, min_y, max_x - min_x, max_y - min_y))
+
+    def __finish_live_stroke(self):
+        # the stroke being drawn is moved from its own item to the canvas image
+        if self.__live_item is None:
+            return
+        self.__scene.removeItem(self.__live_item)
+        self.__live_item, self.__live_path = None, None
+        if self.__stroke is not None and self.__stroke.kind == StrokeKind.INK and len(self.__stroke) > 1:
+            self.__paint_on_canvas(StrokeKind.INK, self.__stroke.width, self.__stroke.points)
+
     def resizeEvent(self, a0: QResizeEvent) -> None:
         super().resizeEvent(a0)
         self.on_resize()
@@ -133,18 +270,33 @@ class ScenePainter(QGraphicsView):
                 if self.__mode == ScenePainterMode.PAINT:
                     pen = QPen()
                     pen.setColor(QColor(0, 0, 0, 255))
-                    pen.setWidth(2)
+                    pen.setWidth(self.__pen_width)
                     point_from = self.mapToScene(self.__mouseX, self.__mouseY)
-                    self.__scene.addLine(point_from.x(), point_from.y(), mouse_pos.x(), mouse_pos.y(), pen)
+                    if self.__canvas_mode == CanvasMode.RASTER:
+                        if self.__live_item is None:
+                            self.__live_path = QPainterPath(point_from)
+                            self.__live_item = self.__scene.addPath(self.__live_path, pen)
+                        self.__live_path.lineTo(mouse_pos)
+                        self.__live_item.setPath(self.__live_path)
+                    else:
+                        self.__scene.addLine(point_from.x(), point_from.y(), mouse_pos.x(), mouse_pos.y(), pen)
+                    if len(self.__stroke) == 0:
+                        self.__stroke.add_point(point_from.x(), point_from.y())
+                    self.__stroke.add_point(mouse_pos.x(), mouse_pos.y())
                 elif self.__mode == ScenePainterMode.ERASE:
-                    pen = QPen()
-                    pen.setColor(QColor(255, 255, 255, 255))
-                    brush = QBrush()
-                    brush.setColor(QColor(255, 255, 255, 255))
-                    self.__scene.addRect(mouse_pos.x() - self.__eraser_size / 2, mouse_pos.y() - self.__eraser_size / 2,
-                                         self.__eraser_size, self.__eraser_size, pen, brush)
+                    self.__stroke.add_point(mouse_pos.x(), mouse_pos.y())
+                    if self.__canvas_mode == CanvasMode.RASTER:
+                        # erasing is painted on the canvas at once, it does not need an item
+                        self.__paint_on_canvas(StrokeKind.ERASE, self.__eraser_size, self.__stroke.points[-1:])
+                    else:
+                        pen = QPen()
+                        pen.setColor(QColor(255, 255, 255, 255))
+                        brush = QBrush(QColor(255, 255, 255, 255))
+                        self.__scene.addRect(mouse_pos.x() - self.__eraser_size / 2,
+                                             mouse_pos.y() - self.__eraser_size / 2,
+                                             self.__eraser_size, self.__eraser_size, pen, brush)
                 else:
-                    print("error: unrecognized mode (", self.__mode, ")")
+                    logger.error("unrecognized mode (%s)", self.__mode)
                     # TODO: how to terminate?
             self.__mouseX = a0.pos().x()
             self.__mouseY = a0.pos().y()
@@ -153,8 +305,14 @@ class ScenePainter(QGraphicsView):
     def mousePressEvent(self, a0: QMouseEvent):
         super().mousePressEvent(a0)
         self.__mouse_pressed = True
+        if self.__mode == ScenePainterMode.PAINT:
+            self.__stroke = self.__strokes.begin(StrokeKind.INK, self.__pen_width)
+        else:
+            self.__stroke = self.__strokes.begin(StrokeKind.ERASE, self.__eraser_size)
 
     def mouseReleaseEvent(self, a0: QMouseEvent) -> None:
         self.__mouseX, self.__mouseY = None, None
         self.__mouse_pressed = False
+        self.__finish_live_stroke()
+        self.__strokes.end()
         super().mouseReleaseEvent(a0)
@@ -0,0 +1,155 @@
+# content-addressed cache of predictions: clusters with the same pixels (up to a shift) and normalized inputs
+# with the same values get the stored probabilities instead of being converted and predicted again
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import metrics
+from image_converter import ImageConverter
+
+
+class PredictionCache(object):
+    # a thread-safe LRU cache {key: tuple of numpy arrays}, the least recently used entries are evicted
+    # when the total size of the stored arrays exceeds max_bytes. Stored arrays are shared by all callers,
+    # so they should be read-only. hits and misses are counted by get(), unless the caller counts them itself
+    # (see add_stats())
+    __default = None
+    __default_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_default():
+        # the cache shared by everything in the process
+        with PredictionCache.__default_lock:
+            if PredictionCache.__default is None:
+                PredictionCache.__default = PredictionCache()
+            return PredictionCache.__default
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_size(self):
+        return self.__bytes
+
+    def get(self, key: bytes, count: bool = True):
+        with self.__lock:
+            value = self.__entries.get(key)
+            if value is None:
+                self.misses += count
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += count
+            return value
+
+    def add_stats(self, hits: int, misses: int):
+        with self.__lock:
+            self.hits += hits
+            self.misses += misses
+
+    def put(self, key: bytes, value: tuple):
+        size = len(key) + sum(array.nbytes for array in value)
+        if size > self.__max_bytes:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self.__bytes -= len(key) + sum(array.nbytes for array in self.__entries.pop(key))
+            self.__entries[key] = value
+            self.__bytes += size
+            while self.__bytes > self.__max_bytes:
+                old_key, old_value = self.__entries.popitem(last=False)
+                self.__bytes -= len(old_key) + sum(array.nbytes for array in old_value)
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def get_stats(self):
+        with self.__lock:
+            return {"entries": len(self.__entries), "bytes": self.__bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+def get_cluster_key(namespace: str, cluster):
+    # the key of a set of pixels does not depend on its position and on the order of the pixels
+    xs = cluster.xs - cluster.min_x
+    ys = cluster.ys - cluster.min_y
+    order = np.lexsort((xs, ys))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(b"cluster:" + namespace.encode())
+    digest.update(np.array([cluster.max_x - cluster.min_x, cluster.max_y - cluster.min_y], dtype=np.int32).tobytes())
+    digest.update(xs[order].astype(np.int32).tobytes())
+    digest.update(ys[order].astype(np.int32).tobytes())
+    return digest.digest()
+
+
+def get_input_key(namespace: str, data: np.ndarray):
+    # the key of a normalized (28, 28, 1) input
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(b"input:" + namespace.encode())
+    digest.update(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+    return digest.digest()
+
+
+def predict_clusters(clusters: list, recognizer, cache: PredictionCache = None):
+    # converts and predicts clusters like ImageConverter.convert_batch and recognizer.predict_batch,
+    # but clusters (and inputs) found in the cache are not converted (predicted) again;
+    # returns the list of scaled images (read-only, they may be shared with other callers) and (n, 10) probabilities.
+    # A cluster is a hit if it is found by either key, and a miss if it has to be predicted
+    cache = cache if cache is not None else PredictionCache.get_default()
+    namespace = recognizer.get_backend().name
+    images = [None] * len(clusters)
+    predictions = np.empty((len(clusters), 10), dtype=np.float32)
+
+    cluster_keys = [get_cluster_key(namespace, cluster) for cluster in clusters]
+    missing = []
+    for i, key in enumerate(cluster_keys):
+        value = cache.get(key, count=False)
+        if value is None:
+            missing.append(i)
+        else:
+            predictions[i], images[i] = value
+    if len(missing) == 0:
+        cache.add_stats(len(clusters), 0)
+        metrics.count("cache_hits", len(clusters))
+        return images, predictions
+
+    with metrics.span("conversion"):
+        cluster_data, missing_images = ImageConverter.convert_batch([clusters[i] for i in missing])
+    for image in missing_images:
+        image.setflags(write=False)
+    input_keys = [get_input_key(namespace, data) for data in cluster_data]
+    # equal inputs of the same batch are predicted once: {key: indices of the missing clusters}
+    to_predict = OrderedDict()
+    for j, key in enumerate(input_keys):
+        if key in to_predict:
+            to_predict[key].append(j)
+            continue
+        value = cache.get(key, count=False)
+        if value is None:
+            to_predict[key] = [j]
+        else:
+            predictions[missing[j]] = value[0]
+    misses = sum(len(js) for js in to_predict.values())
+    cache.add_stats(len(clusters) - misses, misses)
+    metrics.count("cache_hits", len(clusters) - misses)
+    metrics.count("cache_misses", misses)
+
+    with metrics.span("inference"):
+        predicted = recognizer.predict_batch(cluster_data[[js[0] for js in to_predict.values()]])
+    for (key, js), prediction in zip(to_predict.items(), predicted):
+        predictions[[missing[j] for j in js]] = prediction
+        cache.put(key, (prediction.copy(),))
+    for j, i in enumerate(missing):
+        images[i] = missing_images[j]
+        cache.put(cluster_keys[i], (predictions[i].copy(), missing_images[j]))
+    return images, predictions
@@ -0,0 +1,289 @@
+# local recognition service: one process keeps the model loaded and serves many tools over TCP.
+# Concurrent requests are grouped into micro-batches, so the model is called once for many callers.
+# usage: python recognition_service.py [--port 8765] [--max-batch-size 64] [--max-wait-ms 5] [options]
+#
+# Protocol: every request is a line of JSON followed by "size" bytes of payload, the response is a line of JSON.
+# The header is {"id": any, "kind": "image" | "tensor" | "stats", "size": payload bytes, ...}:
+# - "image": a grayscale image, either raw ("shape": [height, width], uint8) or encoded ("encoded": true, PNG, ...),
+#   "options" are BatchOptions arguments; the response is {"id", "text", "digits", "time", "stages"}
+# - "tensor": normalized digits as float32 of "shape" (n, 28, 28) or (n, 28, 28, 1);
+#   the response is {"id", "digits": [n digits], "probabilities": [n lists of 10], "time"}
+# - "stats": the response is {"id", "stats": counters of the micro-batches}
+# Responses of one connection may come in another order than requests, they are matched by "id";
+# a failed request gets {"id", "error"}
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import metrics
+from batch_recognize import BatchOptions, BACKENDS, recognize_image
+from numbers_recognition import NumbersRecognizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class MicroBatcher(object):
+    # collects inputs of concurrent callers into batches: a batch is predicted when it has max_batch_size inputs
+    # or when max_wait seconds have passed since its first input arrived. Inputs which arrive while a batch
+    # is being predicted form the next batch, so the batches grow with the load. The model is called
+    # by a single thread, it is never used concurrently
+    def __init__(self, recognizer: NumbersRecognizer, max_batch_size: int = 64, max_wait: float = 0.005):
+        self.__recognizer = recognizer
+        self.__max_batch_size = max_batch_size
+        self.__max_wait = max_wait
+        self.__queue = None
+        self.__executor = ThreadPoolExecutor(1, thread_name_prefix="inference")
+        self.__stats = {"requests": 0, "inputs": 0, "batches": 0, "max_batch_size": 0, "inference_seconds": 0.0}
+
+    def get_recognizer(self):
+        return self.__recognizer
+
+    def get_stats(self):
+        stats = dict(self.__stats)
+        stats["mean_batch_size"] = stats["inputs"] / stats["batches"] if stats["batches"] > 0 else 0.0
+        return stats
+
+    async def predict(self, inputs: np.ndarray):
+        # (n, 28, 28, 1) inputs -> (n, 10) probabilities
+        if len(inputs) == 0:
+            return np.empty((0, 10), dtype=np.float32)
+        future = asyncio.get_running_loop().create_future()
+        await self.__queue.put((inputs, future))
+        return await future
+
+    async def run(self):
+        self.__queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.__queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.__max_wait
+            while size < self.__max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self.__queue.get_nowait() if timeout <= 0 else \
+                        await asyncio.wait_for(self.__queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(item)
+                size += len(item[0])
+            await self.__predict(loop, batch, size)
+
+    async def __predict(self, loop, batch: list, size: int):
+        inputs = np.concatenate([item[0] for item in batch])
+        start = time.perf_counter()
+        try:
+            predictions = await loop.run_in_executor(self.__executor, self.__recognizer.predict_batch, inputs,
+                                                     max(size, 1))
+        except Exception as e:
+            logger.exception("inference of a batch of %d inputs failed", size)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.__stats["requests"] += len(batch)
+        self.__stats["inputs"] += size
+        self.__stats["batches"] += 1
+        self.__stats["max_batch_size"] = max(self.__stats["max_batch_size"], size)
+        self.__stats["inference_seconds"] += time.perf_counter() - start
+        logger.debug("batch of %d inputs from %d requests", size, len(batch))
+        offset = 0
+        for inputs, future in batch:
+            # a caller may have gone away (cancelled) meanwhile
+            if not future.done():
+                future.set_result(predictions[offset:offset + len(inputs)])
+            offset += len(inputs)
+
+
+class _BatchedRecognizer(object):
+    # the recognizer interface used by recognize_image() in segmentation threads: predictions are made
+    # by the micro-batcher in the event loop, the calling thread waits for them
+    def __init__(self, batcher: MicroBatcher, loop):
+        self.__batcher = batcher
+        self.__loop = loop
+
+    def get_backend(self):
+        return self.__batcher.get_recognizer().get_backend()
+
+    def predict_batch(self, inputs: np.ndarray, batch_size: int = 256):
+        return asyncio.run_coroutine_threadsafe(self.__batcher.predict(inputs), self.__loop).result()
+
+
+class RecognitionService(object):
+    def __init__(self, recognizer: NumbersRecognizer, max_batch_size: int = 64, max_wait: float = 0.005,
+                 segmentation_workers: int = 4):
+        self.__batcher = MicroBatcher(recognizer, max_batch_size, max_wait)
+        # segmentation of images is the long part of a request, it runs in threads
+        self.__executor = ThreadPoolExecutor(segmentation_workers, thread_name_prefix="segmentation")
+        self.__recognizer = None
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.__recognizer = _BatchedRecognizer(self.__batcher, asyncio.get_running_loop())
+        batcher = asyncio.create_task(self.__batcher.run())
+        server = await asyncio.start_server(self.__handle_connection, host, port)
+        logger.info("serving on %s", ", ".join(str(s.getsockname()) for s in server.sockets))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def recognize_image(self, image: np.ndarray, options: BatchOptions):
+        recorder = metrics.Recorder("request")
+
+        def recognize():
+            with metrics.recording(recorder):
+                return recognize_image(image, options, self.__recognizer)
+
+        digits = await asyncio.get_running_loop().run_in_executor(self.__executor, recognize)
+        return {"text": "".join(str(d["digit"]) for d in digits), "digits": digits,
+                "stages": {stage: round(duration, 4) for stage, duration in recorder.get_durations().items()}}
+
+    async def predict_tensors(self, tensors: np.ndarray):
+        if tensors.ndim == 3:
+            tensors = tensors[..., np.newaxis]
+        if tensors.shape[1:] != (28, 28, 1):
+            raise ValueError("Tensors should be of shape (n, 28, 28) or (n, 28, 28, 1), not %s" % (tensors.shape,))
+        predictions = await self.__batcher.predict(tensors)
+        return {"digits": predictions.argmax(axis=1).tolist(), "probabilities": predictions.round(6).tolist()}
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # requests of a connection are processed concurrently, so a client may send many without waiting
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                header = json.loads(line)
+                payload = await reader.readexactly(int(header.get("size", 0)))
+                task = asyncio.create_task(self.__handle_request(header, payload, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning("connection is closed: %s", e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def __handle_request(self, header: dict, payload: bytes, writer: asyncio.StreamWriter):
+        start = time.perf_counter()
+        response = {"id": header.get("id")}
+        try:
+            kind = header.get("kind")
+            if kind == "image":
+                response.update(await self.recognize_image(decode_image(header, payload),
+                                                           BatchOptions(**header.get("options", {}))))
+            elif kind == "tensor":
+                shape = tuple(header["shape"])
+                response.update(await self.predict_tensors(np.frombuffer(payload, dtype=np.float32).reshape(shape)))
+            elif kind == "stats":
+                response["stats"] = self.__batcher.get_stats()
+            else:
+                raise ValueError("Unknown request kind: %s" % kind)
+        except Exception as e:
+            logger.debug("request %s failed", response["id"], exc_info=True)
+            response = {"id": response["id"], "error": "%s: %s" % (type(e).__name__, e)}
+        response["time"] = round(time.perf_counter() - start, 4)
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+
+def decode_image(header: dict, payload: bytes):
+    if header.get("encoded"):
+        image = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError("Cannot decode the image")
+        return image
+    return np.frombuffer(payload, dtype=np.uint8).reshape(tuple(header["shape"]))
+
+
+def encode_request(request_id, kind: str, array: np.ndarray = None, options: dict = None):
+    # a request for the service: raw uint8 images and float32 tensors are sent as they are
+    header = {"id": request_id, "kind": kind}
+    payload = b""
+    if array is not None:
+        array = np.ascontiguousarray(array, dtype=np.float32 if kind == "tensor" else np.uint8)
+        header["shape"] = list(array.shape)
+        payload = array.tobytes()
+    if options:
+        header["options"] = options
+    header["size"] = len(payload)
+    return (json.dumps(header) + "\n").encode() + payload
+
+
+class RecognitionClient(object):
+    # a blocking client for tools, one request at a time
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, timeout: float = 60):
+        self.__socket = socket.create_connection((host, port), timeout=timeout)
+        self.__file = self.__socket.makefile("rb")
+        self.__next_id = 0
+
+    def close(self):
+        self.__file.close()
+        self.__socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def recognize_image(self, image: np.ndarray, **options):
+        # a grayscale image, options are BatchOptions arguments
+        return self.__request("image", image, options)
+
+    def predict_tensors(self, tensors: np.ndarray):
+        return self.__request("tensor", tensors)
+
+    def get_stats(self):
+        return self.__request("stats")["stats"]
+
+    def __request(self, kind: str, array: np.ndarray = None, options: dict = None):
+        self.__next_id += 1
+        self.__socket.sendall(encode_request(self.__next_id, kind, array, options))
+        line = self.__file.readline()
+        if not line:
+            raise ConnectionError("The service has closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local digits recognition service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=64, help="inputs predicted at once at most")
+    parser.add_argument("--max-wait-ms", type=float, default=5,
+                        help="how long the first input of a batch waits for others")
+    parser.add_argument("--segmentation-workers", type=int, default=4, help="threads segmenting images")
+    parser.add_argument("--backend", choices=BACKENDS, help="model backend")
+    parser.add_argument("--debug", action="store_true", help="log every batch")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    # the model is loaded once before the service accepts connections
+    recognizer = NumbersRecognizer.get_instance(BatchOptions(backend=args.backend).get_backend())
+    service = RecognitionService(recognizer, args.max_batch_size, args.max_wait_ms / 1000, args.segmentation_workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# vector model of a drawing: the ordered list of ink strokes and eraser paths, every one is a polyline
+# stored as a numpy array of its vertices. The drawing is rasterized on demand, so the recognition pipeline
+# does not need to render the scene and scan it back, and it knows which stroke every ink pixel belongs to
+from enum import Enum
+import numpy as np
+
+
+class StrokeKind(Enum):
+    INK = 1
+    ERASE = 2
+
+
+class Stroke(object):
+    # an ink polyline drawn with a pen of the given width, or an eraser path: squares of the given size
+    # centered at the vertices
+    def __init__(self, kind: StrokeKind, width: int):
+        self.kind = kind
+        self.width = width
+        self.__points = np.empty((16, 2), dtype=np.float32)
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    @property
+    def points(self):
+        return self.__points[:self.__count]
+
+    def add_point(self, x: float, y: float):
+        # the buffer grows geometrically, so adding a point is amortized O(1)
+        if self.__count == len(self.__points):
+            self.__points = np.resize(self.__points, (2 * len(self.__points), 2))
+        self.__points[self.__count] = (x, y)
+        self.__count += 1
+
+    def get_bounding_box(self):
+        # (min_x, min_y, max_x, max_y) of all pixels the stroke may touch; square caps of a diagonal segment
+        # reach half of the diagonal of the pen square
+        margin = self.width / np.sqrt(2) + 1
+        min_x, min_y = self.points.min(axis=0) - margin
+        max_x, max_y = self.points.max(axis=0) + margin
+        return int(np.floor(min_x)), int(np.floor(min_y)), int(np.ceil(max_x)), int(np.ceil(max_y))
+
+    def copy(self):
+        stroke = Stroke(self.kind, self.width)
+        stroke.__points = self.points.copy()
+        stroke.__count = self.__count
+        return stroke
+
+
+class StrokeModel(object):
+    def __init__(self, width: int = 0, height: int = 0):
+        # the canvas size, everything outside of the canvas is not visible and is not rasterized
+        self.__width = width
+        self.__height = height
+        self.__strokes = []
+        self.__current = None
+
+    def __len__(self):
+        return len(self.__strokes)
+
+    def set_size(self, width: int, height: int):
+        self.__width = width
+        self.__height = height
+
+    def get_size(self):
+        return self.__width, self.__height
+
+    def get_strokes(self):
+        return list(self.__strokes)
+
+    def begin(self, kind: StrokeKind, width: int):
+        self.__current = Stroke(kind, width)
+        self.__strokes.append(self.__current)
+        return self.__current
+
+    def add_point(self, x: float, y: float):
+        self.__current.add_point(x, y)
+
+    def end(self):
+        # strokes without points do not change the drawing
+        if self.__current is not None and len(self.__current) == 0:
+            self.__strokes.remove(self.__current)
+        self.__current = None
+
+    def clear(self):
+        self.__strokes = []
+        self.__current = None
+
+    def snapshot(self):
+        # a copy to be used by another thread: finished strokes are never changed, so they are shared,
+        # the stroke being drawn is copied
+        model = StrokeModel(self.__width, self.__height)
+        model.__strokes = [stroke.copy() if stroke is self.__current else stroke for stroke in self.__strokes
+                           if len(stroke) > 0]
+        return model
+
+    def get_dirty_rects(self, previous: "StrokeModel"):
+        # bounding boxes (min_x, min_y, max_x, max_y) of everything drawn or erased since the previous snapshot,
+        # or None if the drawing is not a continuation of the previous one (it has been cleared)
+        if len(previous.__strokes) > len(self.__strokes):
+            return None
+        if any(a is not b for a, b in zip(previous.__strokes, self.__strokes)):
+            return None
+        rects = [stroke.get_bounding_box() for stroke in self.__strokes[len(previous.__strokes):]]
+        # if the canvas has been resized, ink may have appeared or disappeared between the old and the new borders
+        (width, height), (previous_width, previous_height) = self.get_size(), previous.get_size()
+        if width != previous_width:
+            rects.append((min(width, previous_width), 0, max(width, previous_width), max(height, previous_height)))
+        if height != previous_height:
+            rects.append((0, min(height, previous_height), max(width, previous_width), max(height, previous_height)))
+        return rects
+
+    def rasterize(self):
+        # returns the matrix of indices of the strokes (starting from 1, 0 is no ink) which cover every pixel
+        # of the bounding box of the ink, and the position of the matrix on the canvas (offset_x, offset_y).
+        # Strokes and eraser paths are applied in the order they were drawn.
+        # OpenCV is imported here, the painter imports this module at startup (see WarmUpThread)
+        import cv2
+
+        boxes = [stroke.get_bounding_box() for stroke in self.__strokes if stroke.kind == StrokeKind.INK]
+        if len(boxes) == 0:
+            return np.zeros((0, 0), dtype=np.int32), 0, 0
+        boxes = np.array(boxes)
+        min_x, min_y = max(int(boxes[:, 0].min()), 0), max(int(boxes[:, 1].min()), 0)
+        max_x, max_y = min(int(boxes[:, 2].max()), self.__width - 1), min(int(boxes[:, 3].max()), self.__height - 1)
+        if max_x < min_x or max_y < min_y:
+            return np.zeros((0, 0), dtype=np.int32), 0, 0
+
+        strokes = np.zeros((max_y - min_y + 1, max_x - min_x + 1), dtype=np.int32)
+        offset = np.array([min_x, min_y], dtype=np.float32)
+        # consecutive ink strokes are rasterized at once, only their pixels are touched, not the whole bounding box
+        run = []
+        for i, stroke in enumerate(self.__strokes + [None]):
+            if stroke is not None and stroke.kind == StrokeKind.INK:
+                if len(stroke) > 1:
+                    run.append(i)
+                continue
+            if len(run) > 0:
+                xs, ys, owners = get_pen_pixels([self.__strokes[j].points for j in run],
+                                                [self.__strokes[j].width for j in run])
+                xs, ys = xs - min_x, ys - min_y
+                visible = (xs >= 0) & (xs < strokes.shape[1]) & (ys >= 0) & (ys < strokes.shape[0])
+                xs, ys, owners = xs[visible], ys[visible], owners[visible]
+                # the pixels are ordered by strokes, a pixel of several strokes belongs to the last one drawn
+                bounds = np.searchsorted(owners, np.arange(len(run) + 1))
+                for j, start, end in zip(run, bounds[:-1].tolist(), bounds[1:].tolist()):
+                    strokes[ys[start:end], xs[start:end]] = j + 1
+                run = []
+            if stroke is not None:
+                points = np.round(stroke.points - offset).astype(np.int32)
+                half = stroke.width / 2
+                for x, y in points.tolist():
+                    cv2.rectangle(strokes, (int(x - half), int(y - half)), (int(x + half), int(y + half)), 0,
+                                  thickness=-1)
+        return strokes, min_x, min_y
+
+    def get_ink(self):
+        # returns coordinates of ink pixels and their groups: pieces of strokes, a stroke broken by the eraser
+        # is split into several pieces. Pixels of a group are very likely to belong to the same digit
+        from scipy.ndimage import label
+
+        strokes, offset_x, offset_y = self.rasterize()
+        ys, xs = np.nonzero(strokes)
+        if len(xs) == 0:
+            return xs.astype(np.int32), ys.astype(np.int32), np.zeros(0, dtype=np.int32)
+        components, _ = label(strokes > 0, structure=np.ones((3, 3), dtype=bool))
+        pieces = strokes[ys, xs].astype(np.int64) * (int(components.max()) + 1) + components[ys, xs]
+        _, groups = np.unique(pieces, return_inverse=True)
+        return (xs + offset_x).astype(np.int32), (ys + offset_y).astype(np.int32), groups.astype(np.int32)
+
+
+def get_pen_pixels(polylines: list, widths: list):
+    # coordinates (xs, ys) of the pixels covered by the segments of polylines and the indices of the polylines
+    # covering them (in ascending order), like Qt draws separate lines with a pen of the given width (square caps)
+    # without antialiasing: a segment is a rectangle of the pen width extended by half of the width beyond its ends,
+    # and a pixel is covered if its center is inside. The pixels may repeat. Qt draws lines of a 1 pixel pen
+    # with another algorithm, they differ a little
+    starts = np.concatenate([points[:-1] for points in polylines]).astype(np.float64)
+    ends = np.concatenate([points[1:] for points in polylines]).astype(np.float64)
+    owners = np.repeat(np.arange(len(polylines)), [len(points) - 1 for points in polylines])
+    halves = np.asarray(widths, dtype=np.float64)[owners] / 2
+    lengths = np.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    cos = np.divide(ends[:, 0] - starts[:, 0], lengths, out=np.ones_like(lengths), where=lengths > 0)
+    sin = np.divide(ends[:, 1] - starts[:, 1], lengths, out=np.zeros_like(lengths), where=lengths > 0)
+    with np.errstate(divide="ignore"):
+        inverse_cos, inverse_sin = 1 / cos, 1 / sin
+
+    # the rectangles are filled row by row, their corners are at most half of the diagonal of the pen square away
+    margins = np.sqrt(2) * halves
+    first_rows = np.floor(np.minimum(starts[:, 1], ends[:, 1]) - margins).astype(np.int64)
+    row_counts = np.ceil(np.maximum(starts[:, 1], ends[:, 1]) + margins).astype(np.int64) - first_rows + 1
+    rows = np.repeat(np.arange(len(starts)), row_counts)
+    ys = np.arange(len(rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts) + first_rows[rows]
+    # in a row, the center of a pixel is dx away from the start of the segment along the x axis and it is inside if
+    # -half < dx * cos + dy * sin <= length + half and -half < dy * cos - dx * sin <= half; both conditions are
+    # intervals of dx (infinite or empty if the segment is parallel to an axis)
+    dy = ys + 0.5 - starts[rows, 1]
+    half, along, across = halves[rows], dy * sin[rows], dy * cos[rows]
+    with np.errstate(invalid="ignore"):
+        a1, a2 = (-half - along) * inverse_cos[rows], (lengths[rows] + half - along) * inverse_cos[rows]
+        b1, b2 = (across - half) * inverse_sin[rows], (across + half) * inverse_sin[rows]
+    x0 = starts[rows, 0] - 0.5
+    # a center exactly on a border is inside if the border is the right one (like Qt does)
+    min_x = np.floor(np.fmax(np.fmin(a1, a2), np.fmin(b1, b2)) + x0) + 1
+    counts = np.floor(np.fmin(np.fmax(a1, a2), np.fmax(b1, b2)) + x0) - min_x + 1
+    counts = np.where(counts > 0, counts, 0).astype(np.int64)
+    min_x = np.where(counts > 0, min_x, 0).astype(np.int64)
+    pixels = np.repeat(np.arange(len(rows)), counts)
+    xs = np.arange(len(pixels)) - np.repeat(np.cumsum(counts) - counts, counts) + min_x[pixels]
+    return xs, ys[pixels], owners[rows[pixels]]
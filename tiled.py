@@ -0,0 +1,246 @@
+# streaming recognition of pages too large to be processed at once (e.g. scans of A3 sheets at 300 dpi):
+# the page is read tile by tile (a .npy page is memory-mapped, so it is never loaded completely), every tile
+# is segmented into connected components of the ink, components crossing tile borders are stitched together,
+# and a digit is emitted as soon as no tile below can extend it. Digits go to the model in batches,
+# so the memory depends on the tile size and the page width, not on the page size
+# usage: python tiled.py <page .npy or image> <results.jsonl> [options]
+import argparse
+import json
+import logging
+import sys
+import time
+import cv2
+import numpy as np
+import metrics
+from cluster import Cluster
+from numbers_recognition import NumbersRecognizer, RecognizerBackend
+from prediction_cache import predict_clusters
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 1024
+# components larger than this in any direction are lines, frames or stains of a form, not digits;
+# their pixels are dropped as soon as they grow that large
+MAX_DIGIT_SIZE = 300
+
+
+def open_page(file_path: str):
+    # a .npy page is memory-mapped, other images are read by OpenCV (they are decoded completely)
+    if file_path.endswith(".npy"):
+        return np.load(file_path, mmap_mode="r")
+    page = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    if page is None:
+        raise IOError("Cannot read image: %s" % file_path)
+    return page
+
+
+class _Components(object):
+    # union-find of the components of all tiles: every component of a tile gets a global id, ids of components
+    # touching each other across a tile border are merged. Ink pixels and bounding boxes are kept per id
+    def __init__(self, max_size: int):
+        self.__max_size = max_size
+        self.__parent = {}
+        self.__pixels = {}
+        self.__boxes = {}
+        self.__discarded = set()
+        self.__next_id = 1
+
+    def add(self, count: int):
+        # returns the first of `count` new ids
+        first = self.__next_id
+        for i in range(first, first + count):
+            self.__parent[i] = i
+        self.__next_id += count
+        return first
+
+    def add_pixels(self, component: int, xs: np.ndarray, ys: np.ndarray):
+        self.__pixels.setdefault(component, []).append((xs, ys))
+        box = (int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max()))
+        old = self.__boxes.get(component, box)
+        self.__boxes[component] = (min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]),
+                                   max(old[3], box[3]))
+
+    def find(self, component: int):
+        root = component
+        while self.__parent[root] != root:
+            root = self.__parent[root]
+        while self.__parent[component] != root:
+            self.__parent[component], component = root, self.__parent[component]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if a in self.__discarded or b in self.__discarded:
+            self.__discarded.update((a, b))
+        self.__parent[b] = a
+
+    def collect(self, live_roots: set):
+        # returns clusters of the finished components (their roots are not live anymore) and forgets them;
+        # live components which have grown too large are discarded
+        members = {}
+        for component in list(self.__parent):
+            members.setdefault(self.find(component), []).append(component)
+        clusters = []
+        for root, components in members.items():
+            boxes = [self.__boxes[c] for c in components if c in self.__boxes]
+            if len(boxes) > 0 and root not in self.__discarded:
+                boxes = np.array(boxes)
+                if max(boxes[:, 2].max() - boxes[:, 0].min(), boxes[:, 3].max() - boxes[:, 1].min()) > \
+                        self.__max_size:
+                    self.__discarded.add(root)
+                    metrics.count("discarded")
+            if root in self.__discarded:
+                for c in components:
+                    self.__pixels.pop(c, None)
+                    self.__boxes.pop(c, None)
+            if root in live_roots:
+                continue
+            pixels = [p for c in components for p in self.__pixels.pop(c, [])]
+            for c in components:
+                del self.__parent[c]
+                self.__boxes.pop(c, None)
+            self.__discarded.difference_update(components)
+            if len(pixels) > 0:
+                clusters.append(Cluster(0, np.concatenate([p[0] for p in pixels]),
+                                        np.concatenate([p[1] for p in pixels])))
+        clusters.sort(key=lambda cluster: (cluster.min_y, cluster.min_x))
+        return clusters
+
+
+def _read_ink(page: np.ndarray, x0: int, y0: int, x1: int, y1: int, threshold: int, invert: bool):
+    tile = np.asarray(page[y0:y1, x0:x1])
+    if tile.ndim == 3:
+        tile = tile[:, :, 0] if tile.shape[2] == 1 else cv2.cvtColor(tile[:, :, :3], cv2.COLOR_RGB2GRAY)
+    if tile.dtype == np.bool_:
+        return tile
+    if invert:
+        tile = 255 - tile
+    return tile < threshold
+
+
+def iter_clusters(page: np.ndarray, tile_size: int = TILE_SIZE, threshold: int = 255, invert: bool = False,
+                  dilation: int = 5, max_digit_size: int = MAX_DIGIT_SIZE):
+    # yields clusters of ink pixels in page coordinates, like ConnectedComponentsEngine(dilation) finds them
+    # on the whole page. Tiles are processed row by row; a tile is read with a margin of `dilation` pixels,
+    # so the dilated ink of its inside is exact. Besides the tile, only the labels of the last row of the previous
+    # row of tiles and of the last column of the previous tile are kept to stitch components
+    height, width = page.shape[:2]
+    components = _Components(max_digit_size)
+    kernel = np.ones((2 * dilation + 1, 2 * dilation + 1), dtype=np.uint8)
+    bottom_line = np.zeros(width, dtype=np.int64)
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        next_bottom_line = np.zeros(width, dtype=np.int64)
+        right_column = None
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            metrics.count("tiles")
+            with metrics.span("extraction"):
+                mx0, my0 = max(x0 - dilation, 0), max(y0 - dilation, 0)
+                ink = _read_ink(page, mx0, my0, min(x1 + dilation, width), min(y1 + dilation, height), threshold,
+                                invert)
+                mask = cv2.dilate(ink.astype(np.uint8), kernel) if dilation > 0 else ink.astype(np.uint8)
+                ink = ink[y0 - my0:y0 - my0 + y1 - y0, x0 - mx0:x0 - mx0 + x1 - x0]
+                mask = mask[y0 - my0:y0 - my0 + y1 - y0, x0 - mx0:x0 - mx0 + x1 - x0]
+            with metrics.span("clustering"):
+                count, labels = cv2.connectedComponents(mask, connectivity=8, ltype=cv2.CV_32S)
+                # global ids of the components of the tile, 0 is the background
+                ids = np.zeros(count, dtype=np.int64)
+                if count > 1:
+                    ids[1:] = np.arange(count - 1) + components.add(count - 1)
+                labels = ids[labels]
+
+                ys, xs = np.nonzero(ink)
+                pixel_labels = labels[ys, xs]
+                order = np.argsort(pixel_labels, kind="stable")
+                pixel_labels, xs, ys = pixel_labels[order], xs[order] + x0, ys[order] + y0
+                starts = np.flatnonzero(np.r_[True, pixel_labels[1:] != pixel_labels[:-1]]) if len(order) else []
+                for start, end in zip(starts, list(starts[1:]) + [len(order)]):
+                    components.add_pixels(int(pixel_labels[start]), xs[start:end].astype(np.int32),
+                                          ys[start:end].astype(np.int32))
+
+                # 8-connected neighbours across the left and the top borders
+                if right_column is not None:
+                    _stitch(components, labels[:, 0], right_column)
+                if y0 > 0:
+                    _stitch(components, labels[0, :], bottom_line[max(x0 - 1, 0):min(x1 + 1, width)],
+                            1 if x0 > 0 else 0)
+                right_column = labels[:, -1]
+                next_bottom_line[x0:x1] = labels[-1, :]
+        bottom_line = next_bottom_line
+        live_roots = {components.find(int(c)) for c in np.unique(bottom_line[bottom_line > 0])}
+        for cluster in components.collect(live_roots if y1 < height else set()):
+            metrics.count("clusters")
+            yield cluster
+
+
+def _stitch(components: _Components, line: np.ndarray, neighbours: np.ndarray, offset: int = 0):
+    # merges components of the border line of a tile with components of the adjacent line of the neighbour tile,
+    # line[i] touches neighbours[i + offset - 1 .. i + offset + 1]
+    for shift in (-1, 0, 1):
+        start = max(0, -(offset + shift))
+        end = min(len(line), len(neighbours) - offset - shift)
+        a = line[start:end]
+        b = neighbours[start + offset + shift:end + offset + shift]
+        touching = (a > 0) & (b > 0)
+        for pair in np.unique(np.column_stack((a[touching], b[touching])), axis=0):
+            components.union(int(pair[0]), int(pair[1]))
+
+
+def recognize_page(page: np.ndarray, recognizer: NumbersRecognizer = None, batch_size: int = 256, **kwargs):
+    # yields dictionaries of the recognized digits in the order they are found (from top to bottom, roughly);
+    # kwargs are arguments of iter_clusters()
+    recognizer = recognizer if recognizer is not None else \
+        NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend())
+    batch = []
+    for cluster in iter_clusters(page, **kwargs):
+        batch.append(cluster)
+        if len(batch) == batch_size:
+            yield from _recognize_batch(batch, recognizer)
+            batch = []
+    yield from _recognize_batch(batch, recognizer)
+
+
+def _recognize_batch(clusters: list, recognizer: NumbersRecognizer):
+    if len(clusters) == 0:
+        return
+    _, predictions = predict_clusters(clusters, recognizer)
+    for cluster, prediction in zip(clusters, predictions):
+        digit = int(np.argmax(prediction))
+        yield {"digit": digit, "probability": float(prediction[digit]), "points": len(cluster),
+               "bbox": [int(c) for c in cluster.get_bounding_box()]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize digits of a large page tile by tile")
+    parser.add_argument("source", help="a .npy page (memory-mapped) or an image")
+    parser.add_argument("output", help="JSON lines file, a line per digit")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--dilation", type=int, default=5, help="dilation in pixels to merge strokes of a digit")
+    parser.add_argument("--threshold", type=int, default=255, help="a pixel is ink when it is darker than this")
+    parser.add_argument("--invert", action="store_true", help="the page has light digits on a dark background")
+    parser.add_argument("--max-digit-size", type=int, default=MAX_DIGIT_SIZE,
+                        help="larger components are not digits")
+    parser.add_argument("--batch-size", type=int, default=256, help="digits predicted at once")
+    parser.add_argument("--backend", choices=[backend.name.lower() for backend in RecognizerBackend])
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    backend = RecognizerBackend[args.backend.upper()] if args.backend else NumbersRecognizer.get_default_backend()
+    recognizer = NumbersRecognizer.get_instance(backend)
+    start = time.perf_counter()
+    count = 0
+    with open(args.output, "w") as file:
+        for digit in recognize_page(open_page(args.source), recognizer, args.batch_size, tile_size=args.tile_size,
+                                    threshold=args.threshold, invert=args.invert, dilation=args.dilation,
+                                    max_digit_size=args.max_digit_size):
+            file.write(json.dumps(digit) + "\n")
+            count += 1
+    print("%d digits recognized in %.2f s" % (count, time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
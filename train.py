@@ -0,0 +1,228 @@
+# training of the recognition model (see build_model() in numbers_recognition.py) on MNIST.
+# The normalized float32 data is memory-mapped and streamed to the model in batches prepared by a background
+# thread, so the dataset is never loaded into memory. Training stops when the accuracy on the validation part
+# of the training set has not improved for `patience` epochs; every epoch is checkpointed, an interrupted
+# training is continued with --resume. The NumPy weights and the int8 model are exported next to the saved model
+# (see get_export_file_paths()), so the NumPy and the int8 backends never serve an older model and a model saved
+# to another --output never replaces the files of the default one
+# usage: python train.py [--epochs 100] [--patience 5] [--resume] [--export] [--report train_report.json]
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+from numbers_recognition import MODEL_FILE_PATH, build_model, ensure_dataset, get_calibration_inputs, \
+    load_normalized
+from numpy_inference import export_weights
+
+try:
+    import resource
+except ImportError:
+    # there is no resource module on Windows, the peak memory is not reported there
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = "data/checkpoint"
+
+
+class BatchStream(object):
+    # batches of (inputs, one-hot labels) read from memory-mapped arrays. The samples are shuffled by chunks:
+    # the order of chunks and the order of samples inside a chunk are random, so the file is read sequentially
+    # chunk by chunk. The shuffle depends on the seed and the epoch only, so a resumed training sees the same
+    # batches. A background thread prepares up to `prefetch` batches while the model trains on the current one
+    def __init__(self, inputs: np.ndarray, labels: np.ndarray, batch_size: int = 128, shuffle: bool = True,
+                 seed: int = 0, chunk_size: int = 8192, prefetch: int = 4):
+        self.__inputs = inputs
+        self.__labels = labels
+        self.__batch_size = batch_size
+        self.__shuffle = shuffle
+        self.__seed = seed
+        # whole batches in a chunk, only the last batch of the last chunk may be smaller
+        self.__chunk_size = max(chunk_size // batch_size, 1) * batch_size
+        self.__prefetch = prefetch
+
+    def __len__(self):
+        return (len(self.__inputs) + self.__batch_size - 1) // self.__batch_size
+
+    def iterate(self, epoch: int = 0):
+        batches = queue.Queue(self.__prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.__batches(epoch):
+                    if not put(batch):
+                        return
+                put(None)
+            except BaseException as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # the consumer may stop early, the producer must not wait for it forever
+            stop.set()
+            thread.join()
+
+    def __batches(self, epoch: int):
+        rng = np.random.default_rng((self.__seed, epoch))
+        starts = np.arange(0, len(self.__inputs), self.__chunk_size)
+        if self.__shuffle:
+            rng.shuffle(starts)
+        for start in starts.tolist():
+            end = min(start + self.__chunk_size, len(self.__inputs))
+            inputs = np.asarray(self.__inputs[start:end], dtype=np.float32)
+            labels = np.asarray(self.__labels[start:end])
+            order = rng.permutation(end - start) if self.__shuffle else np.arange(end - start)
+            for i in range(0, len(order), self.__batch_size):
+                indices = order[i:i + self.__batch_size]
+                yield inputs[indices], np.eye(10, dtype=np.float32)[labels[indices]]
+
+
+def evaluate(model, stream: BatchStream):
+    correct = count = 0
+    for inputs, labels in stream.iterate():
+        predictions = model.predict_on_batch(inputs)
+        correct += int((np.asarray(predictions).argmax(axis=1) == labels.argmax(axis=1)).sum())
+        count += len(inputs)
+    return correct / count if count > 0 else 0.0
+
+
+def get_peak_memory():
+    # the peak resident set size of the process in bytes (ru_maxrss is in kilobytes on Linux)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_export_file_paths(model_file_path: str):
+    # the NumPy weights and the int8 model of a model, for the default model these are NUMPY_WEIGHTS_FILE_PATH
+    # and INT8_MODEL_FILE_PATH of numbers_recognition.py
+    model_file_path = os.path.normpath(model_file_path)
+    return model_file_path + ".npz", model_file_path + "_int8.tflite"
+
+
+def train_model(epochs: int = 100, patience: int = 5, batch_size: int = 128, validation_size: int = 5000,
+                checkpoint_dir: str = CHECKPOINT_DIR, resume: bool = False, model_file_path: str = MODEL_FILE_PATH,
+                seed: int = 0, export: bool = False):
+    # trains the model, saves the best one (by the validation accuracy) to model_file_path and exports its weights
+    # for the NumPy and the int8 backends next to it if model_file_path is the default one (or if export is set);
+    # returns the model and the report of the training
+    import keras
+
+    ensure_dataset()
+    inputs = load_normalized("xtrain")
+    labels = np.load("data/ytrain.npy", mmap_mode="r")
+    split = len(inputs) - validation_size
+    train_stream = BatchStream(inputs[:split], labels[:split], batch_size, True, seed)
+    validation_stream = BatchStream(inputs[split:], labels[split:], 1024, False)
+
+    state_file_path = os.path.join(checkpoint_dir, "state.json")
+    last_file_path = os.path.join(checkpoint_dir, "last")
+    best_file_path = os.path.join(checkpoint_dir, "best")
+    if resume and os.path.exists(state_file_path):
+        # the last checkpoint has the state of the optimizer as well, the training continues where it stopped
+        with open(state_file_path) as file:
+            state = json.load(file)
+        model = keras.models.load_model(last_file_path)
+        logger.info("resuming after epoch %d", state["epoch"])
+    else:
+        state = {"epoch": 0, "best_epoch": 0, "best_accuracy": 0.0, "seconds": 0.0}
+        model = build_model(inputs.shape[1:])
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    while state["epoch"] < epochs and state["epoch"] - state["best_epoch"] < patience:
+        epoch_start = time.perf_counter()
+        epoch = state["epoch"] + 1
+        losses = [model.train_on_batch(x, y)[0] for x, y in train_stream.iterate(epoch)]
+        accuracy = evaluate(model, validation_stream)
+        logger.info("epoch %d: loss %.4f, validation accuracy %.4f, %.1f s", epoch, float(np.mean(losses)), accuracy,
+                    time.perf_counter() - epoch_start)
+
+        if accuracy > state["best_accuracy"]:
+            state.update(best_epoch=epoch, best_accuracy=accuracy)
+            model.save(best_file_path)
+        model.save(last_file_path)
+        state["epoch"] = epoch
+        state["seconds"] += time.perf_counter() - epoch_start
+        # the state is replaced at once, so an interrupted training never sees a half-written one
+        with open(state_file_path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(state_file_path + ".tmp", state_file_path)
+
+    model = keras.models.load_model(best_file_path)
+    model.save(model_file_path)
+    if export or os.path.abspath(model_file_path) == os.path.abspath(MODEL_FILE_PATH):
+        from int8_inference import convert_model
+        weights_file_path, int8_file_path = get_export_file_paths(model_file_path)
+        export_weights(model, weights_file_path)
+        convert_model(model, int8_file_path, get_calibration_inputs(inputs))
+    test_stream = BatchStream(load_normalized("xtest"), np.load("data/ytest.npy", mmap_mode="r"), 1024, False)
+    report = {
+        "epochs": state["epoch"],
+        "best_epoch": state["best_epoch"],
+        "validation_accuracy": state["best_accuracy"],
+        "test_accuracy": evaluate(model, test_stream),
+        # this run only and all runs of a resumed training
+        "wall_seconds": time.perf_counter() - start,
+        "training_seconds": state["seconds"],
+        "peak_memory_bytes": get_peak_memory(),
+    }
+    return model, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the digits recognition model")
+    parser.add_argument("--epochs", type=int, default=100, help="maximum epochs")
+    parser.add_argument("--patience", type=int, default=5,
+                        help="stop when the validation accuracy has not improved for this many epochs")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--validation-size", type=int, default=5000,
+                        help="the last samples of the training set used for validation")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--output", default=MODEL_FILE_PATH, help="where the best model is saved")
+    parser.add_argument("--export", action="store_true",
+                        help="export the NumPy weights and the int8 model of a model saved to another --output "
+                             "next to it, as <output>.npz and <output>_int8.tflite (they are always exported "
+                             "for the default one)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", help="save the report as JSON")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    model, report = train_model(args.epochs, args.patience, args.batch_size, args.validation_size,
+                                args.checkpoint_dir, args.resume, args.output, args.seed, args.export)
+    print("epochs: %d (the best is %d), validation accuracy: %.4f, test accuracy: %.4f"
+          % (report["epochs"], report["best_epoch"], report["validation_accuracy"], report["test_accuracy"]))
+    print("wall time: %.1f s, peak memory: %s" % (report["wall_seconds"], "unknown" if report["peak_memory_bytes"]
+                                                  is None else "%.1f MB" % (report["peak_memory_bytes"] / 2 ** 20)))
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
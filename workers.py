@@ -0,0 +1,137 @@
+import importlib
+import logging
+import threading
+import time
+import traceback
+import metrics
+from PyQt6.QtCore import QThread, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUpThread(QThread):
+    # heavy modules (scikit-learn, SciPy, OpenCV, the model) are imported and initialized in background,
+    # so that the main window is shown immediately
+    ready = pyqtSignal(float)
+    failed = pyqtSignal(str)
+
+    def run(self):
+        try:
+            self.__warm_up()
+        except Exception as e:
+            traceback.print_exc()
+            self.failed.emit(str(e))
+
+    def __warm_up(self):
+        start_time = time.perf_counter()
+        import numpy as np
+        from sklearn.cluster import KMeans
+        # the modules are imported for their heavy imports only (SciPy, OpenCV)
+        importlib.import_module("cluster")
+        importlib.import_module("image_converter")
+        from numbers_recognition import NumbersRecognizer
+
+        recognizer = NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend())
+        recognizer.predict_batch(np.zeros((1, 28, 28, 1), dtype=np.float32))
+        # the first fit initializes thread pools of scikit-learn
+        KMeans(n_clusters=1, n_init=1).fit(np.zeros((2, 2)))
+
+        self.ready.emit(time.perf_counter() - start_time)
+
+
+class RecognitionCancelled(Exception):
+    pass
+
+
+class RecognitionWorker(QThread):
+    # the whole recognition pipeline (clustering, conversion of clusters to images, prediction) runs off the
+    # GUI thread, the results of every stage are sent back by signals. A run may be cancelled at any time,
+    # cancellation takes effect at the next progress report of the pipeline
+    progress = pyqtSignal(int)
+    clustered = pyqtSignal(list)
+    recognized = pyqtSignal(list, list, object)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, image, engine, auto_find_clusters_count: bool, clusters_count: int, previous=None,
+                 settings=None):
+        # image is anything Clusterizator accepts, except for QPixmap which cannot be used outside the GUI thread.
+        # If image is a StrokeModel and the result of the previous run with the same settings is given,
+        # only the changed part of the drawing is recognized again
+        super().__init__()
+        self.__image = image
+        self.__engine = engine
+        self.__auto_find_clusters_count = auto_find_clusters_count
+        self.__clusters_count = clusters_count
+        self.__previous = previous
+        self.__settings = settings
+        self.__result = None
+        self.__cancel_event = threading.Event()
+        self.__recorder = metrics.Recorder("recognition")
+
+    def get_result(self):
+        # RecognitionResult of the finished run, it may be given to the next run
+        return self.__result
+
+    def get_recorder(self):
+        # spans and counters of the run, complete once the run is finished
+        return self.__recorder
+
+    def cancel(self):
+        self.__cancel_event.set()
+
+    def is_cancelled(self):
+        return self.__cancel_event.is_set()
+
+    def run(self):
+        try:
+            with metrics.recording(self.__recorder):
+                self.__recognize()
+            self.__recorder.finish()
+        except RecognitionCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            traceback.print_exc()
+            self.failed.emit(str(e))
+
+    def __progress_callback(self, progress: int):
+        if self.__cancel_event.is_set():
+            raise RecognitionCancelled()
+        self.progress.emit(progress)
+
+    def __recognize(self):
+        import numpy as np
+        from cluster import Clusterizator
+        from numbers_recognition import NumbersRecognizer
+        from prediction_cache import predict_clusters
+        from strokes import StrokeModel
+        from incremental import RecognitionResult, segment_incrementally
+
+        logger.debug("clusters_count: %d", self.__clusters_count)
+        rs = None
+        if self.__previous is not None and isinstance(self.__image, StrokeModel):
+            rs = segment_incrementally(self.__previous, self.__image, self.__engine, self.__auto_find_clusters_count,
+                                       self.__clusters_count)
+        if rs is None:
+            clusterizator = Clusterizator(self.__image, self.__engine)
+            clusterizator.set_progress_callback(self.__progress_callback)
+            kept, new_clusters = [], clusterizator.clusterize(self.__auto_find_clusters_count, self.__clusters_count)
+        else:
+            kept, new_clusters = rs
+        clusters = [self.__previous.clusters[i] for i in kept] + new_clusters
+        self.__progress_callback(100)
+        self.clustered.emit(clusters)
+
+        # all new clusters are converted and predicted at once (except for the ones found in the prediction cache),
+        # the kept ones are taken from the previous result
+        self.__progress_callback(150)
+        recognizer = NumbersRecognizer.get_instance(NumbersRecognizer.get_default_backend())
+        new_images, new_predictions = predict_clusters(new_clusters, recognizer)
+        self.__progress_callback(200)
+
+        images = [self.__previous.images[i] for i in kept] + new_images
+        predictions = new_predictions
+        if len(kept) > 0:
+            predictions = np.concatenate((self.__previous.predictions[kept], new_predictions))
+        self.__result = RecognitionResult(self.__image, self.__settings, clusters, images, predictions)
+        self.recognized.emit(clusters, images, predictions)